@@ -0,0 +1,208 @@
+"""
+Offline benchmarks of ingest, compute, render and dispatch on a synthetic dataset.
+python benchmark.py --output results.json [--baseline old.json --threshold 0.2]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import io_utils
+import synthetic_data
+from models import Countries, GraphType, StatType
+
+REPEAT = 5
+THRESHOLD = 0.2  # a median slower by more than 20% than the baseline is a regression
+
+
+class FakeBot:
+    """Stands in for telegram.Bot, accepts what the handler sends and answers with file_ids"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        if hasattr(photo, 'read'):
+            photo.read()
+        self.calls += 1
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f'fake-photo-{self.calls}')])
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        return [self.send_photo(chat_id, item.media) for item in media]
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(photo=None)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(photo=None)
+
+    sendMessage = send_message
+
+
+def measure(func: Callable, repeat: int, setup: Optional[Callable] = None) -> Dict[str, float]:
+    """Seconds of func after one warm up run, setup is not timed"""
+    if setup is not None:
+        setup()
+    func()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times), 'runs': repeat}
+
+
+def bind_request(update: dict):
+    from bottle import request as bottle_request
+    body = json.dumps(update).encode('utf-8')
+    bottle_request.bind({'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': 'application/json',
+                         'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)})
+
+
+def run_benchmarks(country_count: int, day_count: int, repeat: int) -> Dict[str, dict]:
+    io_utils.configure_matplotlib()
+    import chart_encoder
+    import dataset
+    import file_id_cache
+    import plot_utils
+    import stats_engine
+    import virus_utils
+    from tg_bot_handler import TelegramBot
+
+    data = virus_utils.fetch_dataset()
+    json_data = dataset.to_pomber_json(data)
+    snapshot_path = io_utils.get_snapshot_path(data.version)
+    country = Countries.ITALY.value
+
+    results = {}
+
+    def bench(name: str, func: Callable, setup: Callable = None):
+        results[name] = measure(func, repeat, setup)
+        print(f'{name:48s} {results[name]["median"] * 1000:9.2f} ms')
+
+    bench('ingest.load_snapshot', lambda: dataset.load_snapshot(snapshot_path, data.version))
+    bench('ingest.build_dataset', lambda: dataset.build_dataset(json_data, data.version))
+    bench('compute.metrics', lambda: stats_engine.compute_metrics(data))
+
+    charts = {
+        'generate_world_stat_10': lambda: plot_utils.generate_world_stat_10(StatType.CONFIRMED),
+        'generate_world_stat_10_active': lambda: plot_utils.generate_world_stat_10(StatType.CONFIRMED, True,
+                                                                                   country),
+        'generate_world_mortality_rate_10': plot_utils.generate_world_mortality_rate_10,
+        'generate_bar_world_stat_10': lambda: plot_utils.generate_bar_world_stat_10(StatType.CONFIRMED),
+        'generate_world_stat_10_per_million': lambda: plot_utils.generate_world_stat_10_per_million(
+            StatType.CONFIRMED),
+        'generate_toll_plot_avg': lambda: plot_utils.generate_toll_plot_avg(StatType.DEATHS),
+        'generate_country_active_plot': lambda: plot_utils.generate_country_active_plot(country,
+                                                                                        StatType.CONFIRMED),
+        'generate_country_active_plot_per_million': lambda: plot_utils.generate_country_active_plot_per_million(
+            country, StatType.CONFIRMED),
+        'generate_country_toll_plot_avg': lambda: plot_utils.generate_country_toll_plot_avg(country,
+                                                                                            StatType.DEATHS),
+        'generate_country_total_plot': lambda: plot_utils.generate_country_total_plot(country, StatType.CONFIRMED),
+    }
+
+    def render(generate: Callable):
+        fig, ax = generate()
+        fig.canvas.draw()  # generate only builds the artists, most of the time goes into rasterising them
+
+    for name, generate in charts.items():
+        bench(f'render.{name}', lambda: render(generate))
+
+    fig, ax = plot_utils.generate_world_stat_10(StatType.CONFIRMED)
+    bench('encode.png', lambda: chart_encoder.encode_figure(fig))
+
+    bot = TelegramBot(token='123456:benchmark', workers=0)
+    bot.tgBOT = FakeBot()
+    graph_type = GraphType.CONFIRMED_TOTAL
+    album_graph_types = [GraphType.CONFIRMED_TOTAL, GraphType.DEATHS_TOTAL, GraphType.CONFIRMED_ACTIVE,
+                         GraphType.DEATHS_ACTIVE]
+
+    def forget_charts():
+        file_id_cache.update_file_ids(lambda data: data.clear())
+        bot.image_cache.clear()
+        version = virus_utils.get_data_version()
+        photo_paths = [io_utils.get_photo_path_world(graph_type, version)]
+        photo_paths += [io_utils.get_photo_path_country(album_graph_type, country.value, version)
+                        for album_graph_type in album_graph_types]
+        for photo_path in photo_paths:
+            if os.path.exists(photo_path):
+                os.remove(photo_path)
+
+    def forget_chart():
+        forget_charts()
+        bind_request(synthetic_data.text_update('/cases'))
+
+    def forget_album():
+        forget_charts()
+        bind_request(synthetic_data.text_update('/ITALY_all'))
+
+    def bind_text(text: str) -> Callable:
+        return lambda: bind_request(synthetic_data.text_update(text))
+
+    bench('dispatch.post_handler_text', bot.post_handler, bind_text('/start'))
+    bench('dispatch.post_handler_callback', bot.post_handler,
+          lambda: bind_request(synthetic_data.callback_update(Countries.GERMANY.name)))
+    bench('dispatch.post_handler_render', bot.post_handler, forget_chart)
+    bench('dispatch.post_handler_file_id', bot.post_handler, bind_text('/cases'))
+    bench('dispatch.post_handler_album', bot.post_handler, forget_album)
+    bench('dispatch.post_handler_album_file_id', bot.post_handler, bind_text('/ITALY_all'))
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Names of benchmarks whose median got slower than the baseline by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = result['median'] / previous['median']
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            print(f'Regression {name}: {previous["median"] * 1000:.2f} ms -> {result["median"] * 1000:.2f} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', help='json file to save results to')
+    parser.add_argument('--baseline', help='json file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        synthetic_data.install_timeseries(work_dir, args.countries, args.days)
+        results = run_benchmarks(args.countries, args.days, args.repeat)
+
+    report = {'params': {'countries': args.countries, 'days': args.days, 'repeat': args.repeat},
+              'python': platform.python_version(),
+              'created': int(time.time()),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
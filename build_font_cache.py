@@ -0,0 +1,47 @@
+"""
+Builds the matplotlib font cache into mplconfig/ so a cold start does not scan system fonts.
+deploy.py runs it before every deploy. Only fonts shipped with matplotlib are kept and their paths are stored
+relative to its data directory, configure_matplotlib resolves them where the bot runs.
+"""
+import glob
+import json
+import os
+from typing import Optional
+
+import io_utils
+
+
+def build_font_cache():
+    os.makedirs(io_utils.SHIPPED_MPL_CONFIG_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(io_utils.SHIPPED_MPL_CONFIG_DIR, 'fontlist-*.json')):
+        os.remove(path)  # a cache left from an older matplotlib is not read
+    os.environ['MPLCONFIGDIR'] = io_utils.SHIPPED_MPL_CONFIG_DIR
+    os.environ['MPLBACKEND'] = 'Agg'
+
+    import matplotlib
+    from matplotlib import font_manager  # writes the cache on import
+    data_path = os.path.realpath(matplotlib.get_data_path())
+    for path in glob.glob(os.path.join(io_utils.SHIPPED_MPL_CONFIG_DIR, 'fontlist-*.json')):
+        with open(path, 'r') as fp:
+            cache = json.load(fp)
+        for key in ('ttflist', 'afmlist'):
+            # system fonts of this machine are not on the server
+            fonts = [relative_font(font, data_path) for font in cache[key]]
+            cache[key] = [font for font in fonts if font is not None]
+        io_utils.write_json_atomic(path, cache)
+        print(f'Font cache with {len(cache["ttflist"])} of {len(font_manager.fontManager.ttflist)} fonts: {path}')
+
+
+def relative_font(font: dict, data_path: str) -> Optional[dict]:
+    """Font entry with the path relative to the matplotlib data directory, None for other fonts"""
+    fname = font['fname']
+    if os.path.isabs(fname):
+        fname = os.path.realpath(fname)
+        if fname.startswith(data_path + os.sep) is False:
+            return None
+        fname = os.path.relpath(fname, data_path)
+    return dict(font, fname=fname)
+
+
+if __name__ == '__main__':
+    build_font_cache()
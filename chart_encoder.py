@@ -0,0 +1,68 @@
+import functools
+import io
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+PNG = 'png'
+JPEG = 'jpeg'
+
+
+@dataclass(frozen=True)
+class EncodeOptions:
+    format: str = PNG  # png or jpeg, jpeg needs Pillow
+    dpi: int = 100
+    compress_level: int = 6  # zlib level of png, lower is faster and larger
+    palette: bool = True  # quantise png to 256 colors, needs Pillow
+    quality: int = 85  # jpeg only
+
+    def extension(self) -> str:
+        return 'jpg' if self.format == JPEG and pillow_image() is not None else 'png'
+
+
+@functools.lru_cache(maxsize=None)
+def pillow_image():
+    """PIL.Image imported on first use, None if Pillow is not installed"""
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow is optional, matplotlib writes plain PNG without it
+        return None
+    return Image
+
+
+# chart output settings, replace to tune size versus encode time
+encode_options = EncodeOptions()
+
+# matplotlib before 3.4 shares one FT2Font per font file between threads, so only one figure
+# lays out text at a time, compression with Pillow runs outside the lock
+draw_lock = threading.Lock()
+
+
+def encode_figure(fig: 'Figure', options: EncodeOptions = None) -> bytes:
+    """Rasterise and compress the figure once, the same bytes are sent and cached"""
+    if options is None:
+        options = encode_options
+
+    buffer = io.BytesIO()
+    pil_image = pillow_image()
+    if pil_image is None:
+        with draw_lock:
+            fig.savefig(buffer, format='png', dpi=options.dpi)
+        return buffer.getvalue()
+
+    with draw_lock:
+        fig.savefig(buffer, format='rgba', dpi=options.dpi)
+    size = (int(fig.get_figwidth() * options.dpi), int(fig.get_figheight() * options.dpi))
+    image = pil_image.frombuffer('RGBA', size, buffer.getbuffer(), 'raw', 'RGBA', 0, 1).convert('RGB')
+
+    output = io.BytesIO()
+    if options.format == JPEG:
+        image.save(output, format='JPEG', quality=options.quality)
+    else:
+        if options.palette:
+            image = image.quantize(colors=256)
+        image.save(output, format='PNG', compress_level=options.compress_level)
+    return output.getvalue()
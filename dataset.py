@@ -0,0 +1,312 @@
+import csv
+import struct
+from dataclasses import dataclass, replace
+from io import StringIO
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import StatType
+
+STAT_COUNT = len(StatType)
+STAT_NAMES = [stat_type.to_data_name() for stat_type in StatType]
+CSSE_FIRST_DATE_COLUMN = 4  # Province/State, Country/Region, Lat, Long, 1/22/20, ...
+REVISION_DAYS = 14  # upstream may revise this many most recent days, older ones are taken as final
+
+# binary snapshot: header, country names, dates as int64 days since epoch, values as int32 countries x days x stat
+SNAPSHOT_MAGIC = b'CVTS'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_HEADER = struct.Struct('<4sIIIII')  # magic, format, countries, days, stats, size of the country names
+SNAPSHOT_ALIGN = 8  # arrays start on aligned offsets so they can be mapped in place
+INT32 = np.iinfo(np.int32)
+
+
+def to_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_pomber_date(date_str: str) -> np.datetime64:
+    # pomber dates are not zero padded, e.g. 2020-1-22
+    group = date_str.split('-')
+    year = to_int(group[0])
+    month = to_int(group[1])
+    day = to_int(group[2])
+    return np.datetime64(f'{year:04d}-{month:02d}-{day:02d}', 'D')
+
+
+def format_pomber_date(date) -> str:
+    return f'{date.year}-{date.month}-{date.day}'  # not zero padded like the source
+
+
+def is_aligned(entries: list, date_strings: list) -> bool:
+    return len(entries) == len(date_strings) and (not entries or entries[-1]['date'] == date_strings[-1])
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """Columnar timeseries: one row per country, one column per day, one layer per StatType."""
+    countries: List[str]
+    country_index: Dict[str, int]
+    dates: np.ndarray  # datetime64[D], shared by all countries
+    values: np.ndarray  # int64, or int32 mapped from a snapshot, shape (countries, days, len(StatType))
+    version: str = ''  # identifies the source data, derived caches are keyed by it
+    updated: int = 0  # when the source data changed, seconds since epoch
+    updated_label: str = ''  # updated formatted once for the chart labels
+
+    @property
+    def country_count(self) -> int:
+        return len(self.countries)
+
+    @property
+    def day_count(self) -> int:
+        return len(self.dates)
+
+    def row(self, country_name: str) -> Optional[int]:
+        return self.country_index.get(country_name)
+
+    def stat(self, stat_type: StatType) -> np.ndarray:
+        """countries x days view of a single stat"""
+        return self.values[:, :, int(stat_type)]
+
+    def latest(self, stat_type: StatType) -> np.ndarray:
+        """Last known total of every country"""
+        return self.values[:, -1, int(stat_type)]
+
+    def series(self, row: int, stat_type: StatType) -> np.ndarray:
+        return self.values[row, :, int(stat_type)]
+
+
+def entries_to_array(entries: list) -> np.ndarray:
+    """days x stat values of pomber entries"""
+    return np.array([[to_int(item[name]) for name in STAT_NAMES] for item in entries],
+                    dtype=np.int64).reshape(-1, STAT_COUNT)
+
+
+def build_dataset(json_data: dict, version: str = '') -> Dataset:
+    """Convert pomber timeseries json {country: [{date, confirmed, deaths, recovered}]} into a Dataset"""
+    countries = list(json_data.keys())
+
+    # all countries normally share the same date list, fall back to a union axis otherwise
+    date_strings = [item['date'] for item in json_data[countries[0]]] if countries else []
+    if not all(is_aligned(entries, date_strings) for entries in json_data.values()):
+        all_dates = {item['date'] for entries in json_data.values() for item in entries}
+        date_strings = sorted(all_dates, key=parse_pomber_date)
+    dates = np.array([parse_pomber_date(d) for d in date_strings], dtype='datetime64[D]')
+    date_index = {d: idx for idx, d in enumerate(date_strings)}
+
+    values = np.zeros((len(countries), len(dates), STAT_COUNT), dtype=np.int64)
+    for row, country_name in enumerate(countries):
+        entries = json_data[country_name]
+        country_values = entries_to_array(entries)
+        if is_aligned(entries, date_strings):
+            values[row] = country_values
+        else:
+            columns = [date_index[item['date']] for item in entries]
+            values[row, columns] = country_values
+
+    values.setflags(write=False)
+    dates.setflags(write=False)
+    return Dataset(countries=countries,
+                   country_index={name: idx for idx, name in enumerate(countries)},
+                   dates=dates,
+                   values=values,
+                   version=version)
+
+
+def is_unchanged(entries: list, values: np.ndarray) -> bool:
+    """Whether pomber entries hold the same numbers as the days x stat values, without converting them"""
+    return [[item[name] for name in STAT_NAMES] for item in entries] == values.tolist()
+
+
+def merge_dataset(current: Dataset, json_data: dict, version: str = '') -> Optional[Tuple[Dataset, int]]:
+    """
+    Apply a newer pomber json on top of the current dataset converting only the last REVISION_DAYS and new days.
+    Returns the merged dataset and the first day that differs from the current one,
+    None if the countries, the date axis or older days changed and the dataset has to be built from scratch
+    """
+    countries = list(json_data.keys())
+    if countries != current.countries or current.day_count == 0:
+        return None
+
+    date_strings = [item['date'] for item in json_data[countries[0]]]
+    day_count = len(date_strings)
+    if day_count < current.day_count or not all(is_aligned(entries, date_strings) for entries in json_data.values()):
+        return None
+
+    start = max(0, current.day_count - REVISION_DAYS)
+    if parse_pomber_date(date_strings[start]) != current.dates[start]:
+        return None  # history shifted
+    # older days are only compared, a revision there means the whole dataset has to be converted again
+    prefix = current.values[:, :start]
+    if not all(is_unchanged(json_data[name][:start], prefix[row]) for row, name in enumerate(countries)):
+        print(f'Days older than the last {REVISION_DAYS} were revised upstream, building the dataset again')
+        return None
+
+    tail = np.empty((len(countries), day_count - start, STAT_COUNT), dtype=np.int64)
+    for row, country_name in enumerate(countries):
+        tail[row] = entries_to_array(json_data[country_name][start:])
+
+    # rewrite revised days, keep everything before the first revision untouched
+    overlap = current.day_count - start
+    revised = np.flatnonzero((tail[:, :overlap] != current.values[:, start:]).any(axis=(0, 2)))
+    first_changed = start + int(revised[0]) if len(revised) > 0 else current.day_count
+    if first_changed == day_count:
+        return replace(current, version=version), first_changed  # nothing new
+
+    values = np.concatenate((current.values[:, :first_changed], tail[:, first_changed - start:]), axis=1)
+    new_dates = np.array([parse_pomber_date(d) for d in date_strings[current.day_count:]], dtype='datetime64[D]')
+    dates = np.concatenate((current.dates, new_dates))
+    values.setflags(write=False)
+    dates.setflags(write=False)
+    return Dataset(countries=current.countries,
+                   country_index=current.country_index,
+                   dates=dates,
+                   values=values,
+                   version=version), first_changed
+
+
+def to_pomber_json(data: Dataset) -> dict:
+    """Pomber timeseries json of the dataset, for export"""
+    dates = [format_pomber_date(date) for date in data.dates.tolist()]
+    values = data.values.tolist()
+    return {name: [dict(zip(STAT_NAMES, day_values), date=date) for date, day_values in zip(dates, values[row])]
+            for row, name in enumerate(data.countries)}
+
+
+def align(offset: int) -> int:
+    return -(-offset // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+
+def write_snapshot(fp, data: Dataset):
+    """Write the dataset in the binary snapshot format to a binary file object"""
+    if data.values.size > 0 and (data.values.min() < INT32.min or data.values.max() > INT32.max):
+        raise ValueError('Values do not fit the int32 snapshot format')
+    names = '\n'.join(data.countries).encode('utf-8')
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, data.country_count, data.day_count, STAT_COUNT,
+                                  len(names))
+    fp.write(header)
+    fp.write(names)
+    fp.write(bytes(align(len(header) + len(names)) - len(header) - len(names)))
+    fp.write(data.dates.astype('datetime64[D]').astype('<i8').tobytes())
+    fp.write(np.ascontiguousarray(data.values, dtype='<i4').tobytes())
+
+
+def load_snapshot(path: str, version: str = '', updated: int = 0, updated_label: str = '') -> Dataset:
+    """
+    Map a binary snapshot without copying or converting its arrays,
+    processes mapping the same file share its pages in the page cache
+    """
+    with open(path, 'rb') as fp:
+        magic, snapshot_format, country_count, day_count, stat_count, names_size = \
+            SNAPSHOT_HEADER.unpack(fp.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC or snapshot_format != SNAPSHOT_FORMAT or stat_count != STAT_COUNT:
+            raise ValueError(f'Not a snapshot of format {SNAPSHOT_FORMAT}: {path}')
+        names = fp.read(names_size).decode('utf-8')
+
+    countries = names.split('\n') if country_count > 0 else []
+    dates_offset = align(SNAPSHOT_HEADER.size + names_size)
+    values_offset = dates_offset + 8 * day_count
+    shape = (country_count, day_count, STAT_COUNT)
+    if country_count * day_count == 0:
+        dates = np.zeros(day_count, dtype='<i8')  # nothing to map
+        values = np.zeros(shape, dtype='<i4')
+    else:
+        dates = np.asarray(np.memmap(path, dtype='<i8', mode='r', offset=dates_offset, shape=(day_count,)))
+        values = np.asarray(np.memmap(path, dtype='<i4', mode='r', offset=values_offset, shape=shape))
+    dates = dates.view('datetime64[D]')
+    dates.setflags(write=False)
+    values.setflags(write=False)
+    return Dataset(countries=countries,
+                   country_index={name: idx for idx, name in enumerate(countries)},
+                   dates=dates,
+                   values=values,
+                   version=version,
+                   updated=updated,
+                   updated_label=updated_label)
+
+
+@dataclass(frozen=True)
+class CsseReport:
+    """CSSE time series file: one row per location, one column per day"""
+    regions: List[str]  # Province/State, empty for whole countries
+    countries: List[str]  # Country/Region
+    dates: np.ndarray  # datetime64[D]
+    values: np.ndarray  # int64, shape (locations, days)
+
+    def get_location_name(self, row: int) -> str:
+        return self.regions[row] if self.regions[row] else self.countries[row]
+
+
+def parse_csse_date(date_str: str) -> np.datetime64:
+    # CSSE dates look like 1/22/20
+    month, day, year = date_str.split('/')
+    return np.datetime64(f'{2000 + to_int(year):04d}-{to_int(month):02d}-{to_int(day):02d}', 'D')
+
+
+def row_to_array(cells: list, day_count: int) -> np.ndarray:
+    try:
+        values = np.array(cells, dtype=np.int64)
+    except ValueError:  # empty or malformed cells
+        values = np.array([to_int(cell) for cell in cells], dtype=np.int64)
+    if len(values) < day_count:
+        values = np.concatenate((values, np.zeros(day_count - len(values), dtype=np.int64)))
+    return values[:day_count]
+
+
+def parse_csse_csv(csv_content: str) -> CsseReport:
+    """Decode the date header once and read every row straight into an int array"""
+    reader = csv.reader(StringIO(csv_content))
+    header = next(reader)
+    dates = np.array([parse_csse_date(cell) for cell in header[CSSE_FIRST_DATE_COLUMN:]], dtype='datetime64[D]')
+    day_count = len(dates)
+
+    regions = []
+    countries = []
+    rows = []
+    for row in reader:
+        if not row:
+            continue
+        regions.append(row[0])
+        countries.append(row[1])
+        rows.append(row_to_array(row[CSSE_FIRST_DATE_COLUMN:], day_count))
+
+    values = np.array(rows, dtype=np.int64).reshape(len(rows), day_count)
+    values.setflags(write=False)
+    dates.setflags(write=False)
+    return CsseReport(regions=regions, countries=countries, dates=dates, values=values)
+
+
+def aggregate_by_country(report: CsseReport) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum provinces into their countries, returns sorted country names and countries x days values"""
+    names, rows = np.unique(np.array(report.countries, dtype=object), return_inverse=True)
+    values = np.zeros((len(names), len(report.dates)), dtype=np.int64)
+    np.add.at(values, rows, report.values)
+    return names, values
+
+
+def merge_csse_reports(reports: Dict[StatType, CsseReport], version: str = '') -> Dataset:
+    """Align the CSSE global series on one country and date axis, days missing in any series are dropped"""
+    dates = None
+    for report in reports.values():
+        dates = report.dates if dates is None else np.intersect1d(dates, report.dates)
+
+    aggregated = {stat_type: aggregate_by_country(report) for stat_type, report in reports.items()}
+    countries = sorted(set(name for names, _ in aggregated.values() for name in names))
+    country_index = {name: idx for idx, name in enumerate(countries)}
+
+    values = np.zeros((len(countries), len(dates), STAT_COUNT), dtype=np.int64)
+    for stat_type, (names, stat_values) in aggregated.items():
+        rows = [country_index[name] for name in names]
+        columns = np.searchsorted(reports[stat_type].dates, dates)
+        values[rows, :, int(stat_type)] = stat_values[:, columns]
+
+    values.setflags(write=False)
+    dates.setflags(write=False)
+    return Dataset(countries=countries,
+                   country_index=country_index,
+                   dates=dates,
+                   values=values,
+                   version=version)
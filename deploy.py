@@ -0,0 +1,11 @@
+"""
+Deploys to Zeit Now with a font cache built for this deploy: python deploy.py [now arguments]
+"""
+import subprocess
+import sys
+
+from build_font_cache import build_font_cache
+
+if __name__ == '__main__':
+    build_font_cache()
+    sys.exit(subprocess.call(['now'] + sys.argv[1:]))
@@ -0,0 +1,170 @@
+"""
+Local stand-in for the Telegram Bot API methods the bot calls, for load tests without Telegram.
+python fake_telegram_api.py --port 8081, then run the bot with TELEGRAM_API_URL=http://localhost:8081/bot
+"""
+import argparse
+import email
+import itertools
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+BOT_USER = {'id': 100000001, 'is_bot': True, 'first_name': 'COVID-19 Visual bot', 'username': 'fake_covid_bot'}
+PHOTO_SIZES = ((90, 68), (320, 240), (640, 480))  # telegram stores a few scaled copies of each photo
+
+
+def make_file_id() -> str:
+    return 'AgACAgIAAxkDAAI' + secrets.token_urlsafe(60)  # same prefix and length as photo file_ids
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, Optional[str]]:
+    """Form fields of an upload, files are accepted but only their field name is kept"""
+    message = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body)
+    fields = {}
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        if part.get_filename() is not None:
+            fields[name] = None
+        else:
+            fields[name] = part.get_payload(decode=True).decode('utf-8')
+    return fields
+
+
+class FakeTelegramApi:
+    """Answers the methods the bot calls like Telegram does and records when each chat got a reply"""
+
+    def __init__(self, host: str = 'localhost', port: int = 8081, latency_sec: float = 0.0):
+        self.latency_sec = latency_sec
+        self.lock = threading.Lock()
+        self.message_ids = itertools.count(1)
+        self.calls = {}  # method -> count
+        self.first_reply = {}  # chat_id -> time of the first reply
+        self.uploaded_bytes = 0
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive like telegram
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, answer = api.handle(method, self.headers.get('Content-Type', ''), body)
+                payload = json.dumps(answer).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass  # one line per call would flood the load test output
+
+        return Handler
+
+    def handle(self, method: str, content_type: str, body: bytes) -> tuple:
+        if content_type.startswith('multipart/form-data'):
+            fields = parse_multipart(content_type, body)
+        else:
+            fields = json.loads(body) if body else {}
+
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method in ('setWebhook', 'deleteWebhook'):
+            return 200, {'ok': True, 'result': True}
+
+        if method == 'sendMessage':
+            result = self.message(fields, text=fields.get('text'))
+        elif method == 'sendPhoto':
+            result = self.message(fields, photo=self.photo(fields.get('photo'), len(body)))
+        elif method == 'sendMediaGroup':
+            media = fields.get('media')
+            media = json.loads(media) if isinstance(media, str) else media
+            size = len(body) // max(1, len(media))
+            result = [self.message(fields, photo=self.photo(None if item['media'].startswith('attach://')
+                                                            else item['media'], size))
+                      for item in media]
+        elif method == 'editMessageText':
+            result = self.message(fields, text=fields.get('text'))
+        else:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        return 200, {'ok': True, 'result': result}
+
+    def message(self, fields: dict, **content) -> dict:
+        chat_id = int(fields.get('chat_id', 0))
+        with self.lock:
+            self.first_reply.setdefault(chat_id, time.perf_counter())
+            message_id = next(self.message_ids)
+        message = {'message_id': message_id, 'from': BOT_USER, 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}}
+        message.update(content)
+        return message
+
+    def photo(self, file_id: Optional[str], size: int) -> list:
+        """Sizes of a sent photo, an uploaded one gets new file_ids, a resent one keeps its own"""
+        if file_id is None:
+            with self.lock:
+                self.uploaded_bytes += size
+        sizes = []
+        for idx, (width, height) in enumerate(PHOTO_SIZES):
+            is_largest = idx == len(PHOTO_SIZES) - 1
+            sizes.append({'file_id': file_id if file_id is not None and is_largest else make_file_id(),
+                          'file_unique_id': 'AQAD' + secrets.token_urlsafe(12),
+                          'width': width, 'height': height, 'file_size': size * (idx + 1) // len(PHOTO_SIZES)})
+        return sizes
+
+    def reply_time(self, chat_id: int) -> Optional[float]:
+        with self.lock:
+            return self.first_reply.get(chat_id)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'calls': dict(self.calls), 'uploaded_bytes': self.uploaded_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every answer')
+    args = parser.parse_args()
+
+    api = FakeTelegramApi(args.host, args.port, args.latency)
+    print(f'Fake Telegram API on {api.base_url}')
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        print(api.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Hashable, List
+
+from matplotlib import rcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class FigureTemplate:
+    """
+    Figure of one chart kind prepared once: axes, grids, formatters are set up by the setup callback.
+    A request only swaps line/bar data, rescales the axes and updates the texts.
+    """
+
+    def __init__(self, setup: Callable[['FigureTemplate'], None]):
+        self.lock = threading.Lock()  # held from the first change until the chart is encoded
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)  # draw without pyplot, figures are not tracked globally
+        self.ax = self.fig.add_subplot(111)
+        self.lines = []
+        self.line_defaults = []
+        self.bars = []
+        self.bar_texts = []
+        setup(self)
+
+    def set_lines(self, lines: List[tuple]) -> list:
+        """
+        Show (x, y, label, style) lines, hide the rest of the pool and rescale the axes.
+        Returns the visible Line2D objects
+        """
+        for idx, (x, y, label, style) in enumerate(lines):
+            if idx == len(self.lines):
+                line, = self.ax.plot([], [])
+                self.lines.append(line)
+                self.line_defaults.append({'color': f'C{idx}', 'linewidth': rcParams['lines.linewidth']})
+            line = self.lines[idx]
+            line.set_data(x, y)
+            line.set_label(label)
+            line.set_visible(True)
+            line.update({**self.line_defaults[idx], **style})
+
+        for line in self.lines[len(lines):]:
+            line.set_data([], [])
+            line.set_label('_nolegend_')
+            line.set_visible(False)
+
+        self.rescale()
+        return self.lines[:len(lines)]
+
+    def set_barh(self, labels: List[str], values: List[int], text_format: Callable[[int], str]) -> list:
+        """Show horizontal bars with a value text next to each bar, bottom to top"""
+        for idx in range(len(self.bars), len(values)):
+            bar = self.ax.barh(idx, 0, align='center', alpha=0.5, color='C0')[0]
+            self.bars.append(bar)
+            self.bar_texts.append(self.ax.text(0, idx, '', color='black', va='center'))
+
+        for idx, bar in enumerate(self.bars):
+            visible = idx < len(values)
+            bar.set_visible(visible)
+            self.bar_texts[idx].set_visible(visible)
+            if visible:
+                bar.set_width(values[idx])
+                self.bar_texts[idx].set_position((values[idx], idx))
+                self.bar_texts[idx].set_text(text_format(values[idx]))
+
+        self.ax.set_yticks(range(len(labels)))
+        self.ax.set_yticklabels(labels)
+        self.rescale()
+        return self.bars[:len(values)]
+
+    def rescale(self):
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+
+
+templates_lock = threading.Lock()
+templates = {}  # chart key -> FigureTemplate
+render_local = threading.local()  # template locks held by the render of this thread
+
+
+@contextmanager
+def render_session():
+    """
+    Templates used inside stay locked until the session ends, after the chart is encoded.
+    Charts of different templates are prepared in parallel, drawing is serialised by chart_encoder.draw_lock
+    """
+    held = []
+    render_local.held = held
+    try:
+        yield
+    finally:
+        render_local.held = None
+        for lock in reversed(held):
+            lock.release()
+
+
+def get_template(key: Hashable, setup: Callable[[FigureTemplate], None]) -> FigureTemplate:
+    with templates_lock:
+        template = templates.get(key)
+        if template is None:
+            template = FigureTemplate(setup)
+            templates[key] = template
+
+    held = getattr(render_local, 'held', None)
+    if held is not None and template.lock not in held:
+        template.lock.acquire()
+        held.append(template.lock)
+    return template
@@ -0,0 +1,60 @@
+import threading
+from typing import Callable, Optional
+
+import io_utils
+from models import GraphType, Country
+
+cache_lock = threading.Lock()
+file_ids = {}  # chart key -> telegram file_id, loaded from disk on first use
+loaded = False
+
+
+def make_key(graph_type: GraphType, country: Optional[Country], version: str) -> str:
+    location = 'world' if country is None else country.value
+    return f'{graph_type.to_name()}:{location}:{version}'
+
+
+def load_file_ids():
+    global loaded
+    if loaded is False:
+        file_ids.update(io_utils.read_file_ids())
+        loaded = True
+
+
+def get_file_id(graph_type: GraphType, country: Optional[Country], version: str) -> Optional[str]:
+    with cache_lock:
+        load_file_ids()
+        return file_ids.get(make_key(graph_type, country, version))
+
+
+def put_file_id(graph_type: GraphType, country: Optional[Country], version: str, file_id: str):
+    key = make_key(graph_type, country, version)
+
+    def change(data: dict):
+        # charts of versions older than the published one are never sent again,
+        # the pointer is read from disk as another process may have published a newer version
+        kept = {f':{version}', f':{io_utils.read_snapshot_version()}'}
+        for stale_key in [k for k in data if k[k.rindex(':'):] not in kept]:
+            del data[stale_key]
+        data[key] = file_id
+
+    update_file_ids(change)
+
+
+def forget_file_id(graph_type: GraphType, country: Optional[Country], version: str):
+    key = make_key(graph_type, country, version)
+    with cache_lock:
+        load_file_ids()
+        if key not in file_ids:
+            return
+    update_file_ids(lambda data: data.pop(key, None))
+
+
+def update_file_ids(change: Callable[[dict], None]):
+    """Merge with file_ids written by other processes, the cache is replaced by the merged result"""
+    global loaded
+    with cache_lock:
+        data = io_utils.update_file_ids(change)
+        file_ids.clear()
+        file_ids.update(data)
+        loaded = True
@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+MAX_BYTES = 32 * 1024 * 1024  # encoded charts kept in memory per process
+
+
+class ImageCache:
+    """
+    Encoded chart images in an LRU limited by their total size, in front of the image files on disk.
+    Keys include the data version, so an entry never has to be invalidated.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.images = OrderedDict()  # key -> bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self.images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Hashable, image: bytes):
+        if len(image) > self.max_bytes:
+            return  # would evict everything else
+        with self.lock:
+            previous = self.images.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.images[key] = image
+            self.size += len(image)
+            while self.size > self.max_bytes:
+                _, evicted = self.images.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+    def hit_rate(self) -> float:
+        with self.lock:
+            total = self.hits + self.misses
+            return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {'images': len(self.images),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / total if total > 0 else 0.0}
@@ -0,0 +1,45 @@
+"""
+Shows where the startup time goes: python import_report.py [module] [rows]
+Modules are sorted by cumulative import time, which includes the modules they import.
+"""
+import subprocess
+import sys
+from typing import List, Tuple
+
+
+def import_times(module: str) -> List[Tuple[int, int, str]]:
+    """(cumulative us, self us, name) of every module loaded by a fresh interpreter importing module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        print('\n'.join(line for line in result.stderr.splitlines() if line.startswith('import time:') is False))
+        raise SystemExit(f'Cannot import {module}')
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') is False:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if self_us.strip().isdigit() is False:  # header line
+            continue
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return rows
+
+
+def print_report(module: str, count: int):
+    rows = import_times(module)
+    total = sum(self_us for _, self_us, _ in rows)
+    print(f'{module}: {len(rows)} modules, {total / 1000:.1f} ms')
+
+    print('\nCumulative ms  Self ms  Module')
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:count]:
+        print(f'{cumulative_us / 1000:13.1f}  {self_us / 1000:7.1f}  {name}')
+
+    print('\nSlowest modules by own time')
+    for cumulative_us, self_us, name in sorted(rows, key=lambda row: row[1], reverse=True)[:count]:
+        print(f'{self_us / 1000:7.1f} ms  {name.strip()}')
+
+
+if __name__ == '__main__':
+    print_report(sys.argv[1] if len(sys.argv) > 1 else 'main',
+                 int(sys.argv[2]) if len(sys.argv) > 2 else 25)
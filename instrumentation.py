@@ -0,0 +1,210 @@
+"""Stage timers, counters and histograms exposed in Prometheus text format"""
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+registry_lock = threading.Lock()
+registry = []  # metrics in exposition order
+
+
+def format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}  # label values -> count
+        with registry_lock:
+            registry.append(self)
+
+    def inc(self, *label_values: str, value: float = 1):
+        with registry_lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def get(self, *label_values: str) -> float:
+        with registry_lock:
+            return self.values.get(label_values, 0)
+
+    def expose(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [bucket counts, sum, count]
+        with registry_lock:
+            registry.append(self)
+
+    def observe(self, value: float, *label_values: str):
+        with registry_lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self.values[label_values] = series
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, (bucket_counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                labels = format_labels(self.label_names, label_values, f'le="{format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+            labels = format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        with registry_lock:
+            registry.append(self)
+
+    def expose(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        try:
+            lines.append(f'{self.name} {format_value(self.read())}')
+        except Exception as e:
+            logger.warning('Cannot read gauge %s: "%s"', self.name, e)
+        return lines
+
+
+STAGE_SECONDS = Histogram('covid_bot_stage_seconds', 'Time spent in each stage of handling an update', ['stage'])
+CACHE_REQUESTS = Counter('covid_bot_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+RENDERS = Counter('covid_bot_renders_total', 'Charts rendered by graph type', ['graph_type'])
+UPDATES = Counter('covid_bot_updates_total', 'Webhook updates by outcome', ['result'])
+REFRESHES = Counter('covid_bot_data_refreshes_total', 'Background checks of the data source by outcome', ['result'])
+
+gauges = {}  # name -> Gauge, registered once even if the bot is created again
+
+
+def register_gauge(name: str, help_text: str, read: Callable[[], float]):
+    existing = gauges.get(name)
+    if existing is not None:
+        existing.read = read
+        return
+    gauges[name] = Gauge(name, help_text, read)
+
+
+def count_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+request_local = threading.local()  # stage durations of the update handled by this thread
+stages_lock = threading.Lock()  # stages of one update can be timed in several threads
+
+
+@contextmanager
+def timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        stages = getattr(request_local, 'stages', None)
+        if stages is not None:
+            with stages_lock:
+                stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+def timed(stage: str = None):
+    """Decorator timing every call, the stage is the function name if not given"""
+
+    def decorator(func):
+        name = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def request_scope(stage: str = 'update'):
+    """Times a whole update and logs how long each stage inside it took"""
+    stages = {}
+    request_local.stages = stages
+    start = time.perf_counter()
+    try:
+        yield stages
+    finally:
+        request_local.stages = None
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        if stages:
+            details = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in stages.items())
+            logger.info('%s took %.1fms: %s', stage, elapsed * 1000, details)
+
+
+def current_stages() -> Optional[dict]:
+    """Stage durations of the update handled by this thread, to pass on to its worker threads"""
+    return getattr(request_local, 'stages', None)
+
+
+def call_with_stages(stages: Optional[dict], func: Callable, *args, **kwargs):
+    """Runs func in a worker thread timing its stages into the stages of the update it works for"""
+    previous = getattr(request_local, 'stages', None)
+    request_local.stages = stages
+    try:
+        return func(*args, **kwargs)
+    finally:
+        request_local.stages = previous
+
+
+def render_metrics() -> str:
+    with registry_lock:
+        metrics = list(registry)
+    lines = []
+    for metric in metrics:
+        if isinstance(metric, Gauge):
+            lines.extend(metric.expose())
+        else:
+            with registry_lock:
+                lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,16 @@
 import csv
+import fcntl
+import glob
+import importlib.util
 import json
 import os
-from typing import Dict, Any, Optional
+import re
+import shutil
+import tempfile
+import threading
+from typing import Dict, Any, Optional, Callable, Tuple
 
+import chart_encoder
 import virus_utils
 from models import GraphType, GRAPH_TYPES, Country
 
@@ -253,6 +261,41 @@ global dir_path
 dir_path = '' if is_local_run() else '/tmp/'  # for Zeit Now
 print(dir_path)
 
+VERSION_LENGTH = 16  # hex digits of the content hash naming a data version
+VERSIONED_FILE = re.compile(r'_(?P<version>[0-9a-f]{%d})\.\w+$' % VERSION_LENGTH)
+
+# font cache built by build_font_cache.py and shipped with the deploy
+SHIPPED_MPL_CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mplconfig')
+
+
+def configure_matplotlib():
+    """Must run before matplotlib is imported"""
+    os.environ['MPLBACKEND'] = 'Agg'  # no display on the server, skip backend detection
+
+    # matplotlib ignores a read-only config dir and rebuilds the font cache on every cold start,
+    # copy the shipped one to a writable place instead
+    config_dir = os.path.abspath(f'{dir_path}mplconfig')
+    if config_dir != SHIPPED_MPL_CONFIG_DIR and os.path.isdir(SHIPPED_MPL_CONFIG_DIR) \
+            and os.path.isdir(config_dir) is False:
+        shutil.copytree(SHIPPED_MPL_CONFIG_DIR, config_dir)
+        resolve_font_cache(config_dir)
+    os.environ.setdefault('MPLCONFIGDIR', config_dir)
+
+
+def resolve_font_cache(config_dir: str):
+    """The shipped cache keeps font paths relative to the matplotlib data directory, make them absolute here"""
+    spec = importlib.util.find_spec('matplotlib')  # locates the package without importing it
+    if spec is None or not spec.submodule_search_locations:
+        return
+    data_path = os.path.join(list(spec.submodule_search_locations)[0], 'mpl-data')
+    for path in glob.glob(os.path.join(config_dir, 'fontlist-*.json')):
+        with open(path, 'r') as fp:
+            cache = json.load(fp)
+        for key in ('ttflist', 'afmlist'):
+            for font in cache.get(key, []):
+                font['fname'] = os.path.join(data_path, font['fname'])
+        write_json_atomic(path, cache)
+
 
 def read_country_population() -> Dict[str, Any]:
     country_population = {}
@@ -264,16 +307,25 @@ def read_country_population() -> Dict[str, Any]:
     return country_population
 
 
-# lowercase country names
-population = read_country_population()
+population_lock = threading.Lock()
+population = None  # lowercase country names, parsed on first use
+
+
+def get_population_table() -> Dict[str, Any]:
+    global population
+    with population_lock:
+        if population is None:
+            population = read_country_population()
+        return population
 
 
 def get_population(country_server_name: str) -> int:
+    table = get_population_table()
     country_server_name = country_server_name.lower()
     if country_server_name == 'us' or country_server_name == 'united states':
-        return population['united states']
+        return table['united states']
 
-    country = population.get(country_server_name)
+    country = table.get(country_server_name)
     if country is None:
         return 0
     return country
@@ -303,60 +355,205 @@ def read_system_credentials():
     return token, webhook_url
 
 
-def get_photo_path_world(graph_type: GraphType) -> str:
+def get_photo_path_world(graph_type: GraphType, version: str) -> str:
     str_title = GRAPH_TYPES[graph_type]
-    return f'{dir_path}{str_title}_world.png'
+    return f'{dir_path}{str_title}_world_{version}.{chart_encoder.encode_options.extension()}'
 
 
-def get_photo_path_country(graph_type: GraphType, country_name: str) -> str:
+def get_photo_path_country(graph_type: GraphType, country_name: str, version: str) -> str:
     str_title = GRAPH_TYPES[graph_type]
-    return f'{dir_path}{str_title}_location_{country_name}.png'
+    return f'{dir_path}{str_title}_location_{country_name}_{version}.{chart_encoder.encode_options.extension()}'
 
 
-def get_photo_path_url(graph_type: GraphType, country: Country = None) -> str:
+def get_photo_path_url(graph_type: GraphType, country: Country = None, version: str = None) -> str:
     if country is None:
-        return get_photo_path_world(graph_type)
+        return get_photo_path_world(graph_type, version)
     else:
-        return get_photo_path_country(graph_type, country.value)
+        return get_photo_path_country(graph_type, country.value, version)
+
+
+def find_last_photo_path(graph_type: GraphType, country: Country = None) -> Optional[str]:
+    """Newest image of the chart for any data version"""
+    paths = [path for path in glob.glob(get_photo_path_url(graph_type, country, '*'))
+             if VERSIONED_FILE.search(path)]
+    return max(paths, key=os.path.getmtime, default=None)
+
+
+def get_snapshot_path(version: str, extension: str = 'bin') -> str:
+    return f'{dir_path}timeseries_{version}.{extension}'
 
 
-def get_timeseries_data_path() -> str:
-    return f'{dir_path}timeseries_data.txt'
+def get_snapshot_pointer_path() -> str:
+    return f'{dir_path}timeseries_current.txt'
+
+
+def read_snapshot_pointer() -> Optional[Tuple[str, int]]:
+    """Version of the published snapshot and when its data changed at the source, None before the first download"""
+    try:
+        with open(get_snapshot_pointer_path()) as fp:
+            lines = fp.read().split()
+    except FileNotFoundError:
+        return None
+    if not lines:
+        return None
+    return lines[0], int(lines[1]) if len(lines) > 1 else read_pref_date()
+
+
+def stat_snapshot_pointer() -> Optional[Tuple[int, int]]:
+    """Changes whenever a snapshot is published, None before the first one"""
+    try:
+        stat = os.stat(get_snapshot_pointer_path())
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def read_snapshot_version() -> Optional[str]:
+    pointer = read_snapshot_pointer()
+    return None if pointer is None else pointer[0]
+
+
+def publish_snapshot(version: str, updated: int):
+    # readers switch to the new snapshot and its update time with a single rename
+    write_atomic(get_snapshot_pointer_path(), lambda fp: fp.write(f'{version}\n{updated}\n'))
+
+
+def remove_stale_files(keep_versions: set):
+    """Remove snapshots and images of data versions that are no longer served"""
+    for name in os.listdir(dir_path or '.'):
+        match = VERSIONED_FILE.search(name)
+        if match is None or match.group('version') in keep_versions:
+            continue
+        try:
+            os.remove(f'{dir_path}{name}')
+        except FileNotFoundError:
+            pass  # removed by another process
 
 
 def get_prefs_path() -> str:
     return f'{dir_path}settings.txt'
 
 
-def write_timeseries_data(json_data: str):
-    # save file
-    with open(get_timeseries_data_path(), 'w') as outfile:  # create or overwrite
-        json.dump(json_data, outfile)
+def get_file_ids_path() -> str:
+    return f'{dir_path}file_ids.txt'
+
+
+def get_prefs_db_path() -> str:
+    # /tmp of the deploy is wiped on cold starts and not shared between instances, point this at persistent storage
+    return os.environ.get('PREFS_DB_PATH') or f'{dir_path}prefs.db'
+
+
+def write_atomic(path: str, write: Callable[[Any], None], mode: str = 'w'):
+    """Write next to the target and rename it into place, readers never see a partial file"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as fp:
+            write(fp)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_json_atomic(path: str, data: Any):
+    write_atomic(path, lambda fp: json.dump(data, fp))
+
+
+def write_bytes_atomic(path: str, data: bytes):
+    write_atomic(path, lambda fp: fp.write(data), 'wb')
+
+
+class Settings:
+    """settings.txt loaded once and reloaded only when its mtime changes, updates are atomic"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.path = None
+        self.mtime_ns = None
+        self.data = {}
+
+    def read(self) -> dict:
+        """Cached settings, callers must not modify the returned dict"""
+        path = get_prefs_path()
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        with self.lock:
+            if path != self.path or mtime_ns != self.mtime_ns:
+                self.data = {} if mtime_ns is None else self.load(path)
+                self.path = path
+                self.mtime_ns = mtime_ns
+            return self.data
+
+    @staticmethod
+    def load(path: str) -> dict:
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+
+    def write(self, data: dict):
+        with self.lock:
+            write_json_atomic(get_prefs_path(), data)
+            self.mtime_ns = None  # force reload, mtime resolution may hide quick rewrites
+
+    def update(self, values: dict):
+        # lock file serializes read-modify-write between processes
+        with self.lock, open(f'{get_prefs_path()}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            config = dict(self.read())
+            config.update(values)
+            self.write(config)
+
+
+settings = Settings()
 
 
 def read_prefs() -> Optional[dict]:
-    if os.path.exists(get_prefs_path()) is False:
-        return {}
-    with open(get_prefs_path(), 'r') as fp:
-        return json.load(fp)
+    return dict(settings.read())
 
 
 def read_pref_date() -> int:
-    if os.path.exists(get_prefs_path()) is False:
-        return 0
-    config = read_prefs()
-    datetime_val = config.get('datetime')  # not square
+    datetime_val = settings.read().get('datetime')  # not square
     if datetime_val is None:
         return 0
     return int(datetime_val)
 
 
 def write_config(data):
-    with open(get_prefs_path(), 'w') as fp:
-        json.dump(data, fp)
+    settings.write(data)
 
 
 def write_pref_date(date: int):
-    config = read_prefs()
-    config['datetime'] = str(date)
-    write_config(config)
+    settings.update({'datetime': str(date)})
+
+
+def read_pref_value(key: str, default: Any = None) -> Any:
+    return settings.read().get(key, default)
+
+
+def write_pref_values(values: dict):
+    settings.update(values)
+
+
+def read_file_ids() -> dict:
+    if os.path.exists(get_file_ids_path()) is False:
+        return {}
+    with open(get_file_ids_path(), 'r') as fp:
+        return json.load(fp)
+
+
+def write_file_ids(data: dict):
+    write_json_atomic(get_file_ids_path(), data)
+
+
+def update_file_ids(change: Callable[[dict], None]) -> dict:
+    """Apply change to the file_ids on disk, other processes write the same file"""
+    with open(f'{get_file_ids_path()}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data = read_file_ids()
+        change(data)
+        write_file_ids(data)
+        return data
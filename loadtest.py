@@ -0,0 +1,203 @@
+"""
+Replays a mix of webhook updates at a target rate against the bot /api route and reports latency percentiles.
+By default the bot runs in this process on a synthetic dataset, talking to a local fake Telegram API:
+    python loadtest.py --rate 20 --duration 30 --mix "/start=1,/cases=4,/ITALY_cases_daily=3,@GERMANY=1"
+Against a running bot, start it with TELEGRAM_API_URL=http://localhost:8081/bot and pass its route:
+    python loadtest.py --url http://localhost:8090/api
+Mix items are command=weight, @COUNTRY presses a country button of the /country keyboard.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from typing import List, Tuple
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import io_utils
+import synthetic_data
+from fake_telegram_api import FakeTelegramApi
+
+MIX = '/start=1,/stats=1,/cases=3,/fatal_week=2,/fatal_bar=1,/ITALY_cases_daily=2,/US_fatal_total=2,/FRANCE_all=1,@GERMANY=1'
+CHAT_ID_BASE = 1000000  # every update comes from its own chat, so replies can be matched to updates
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_mix(text: str) -> List[Tuple[str, float]]:
+    mix = []
+    for item in text.split(','):
+        command, _, weight = item.strip().rpartition('=')
+        mix.append((command, float(weight)))
+    return mix
+
+
+def build_update(command: str, update_id: int, chat_id: int) -> dict:
+    if command.startswith('@'):
+        return synthetic_data.callback_update(command[1:], update_id, chat_id)
+    return synthetic_data.text_update(command, update_id, chat_id)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def format_latency(values: List[float]) -> str:
+    if not values:
+        return 'no data'
+    ms = [value * 1000 for value in values]
+    return f'p50 {percentile(ms, 50):.1f} ms, p95 {percentile(ms, 95):.1f} ms, p99 {percentile(ms, 99):.1f} ms, ' \
+           f'max {max(ms):.1f} ms'
+
+
+def start_bot(api_url: str, workers: int, country_count: int, day_count: int, work_dir: str) -> Tuple[str, WSGIServer]:
+    """Bottle app of the bot on a synthetic dataset, served on a free local port"""
+    synthetic_data.install_timeseries(work_dir, country_count, day_count)
+    io_utils.configure_matplotlib()
+    from bottle import Bottle
+    from tg_bot_handler import TelegramBot
+
+    app = Bottle()
+    TelegramBot(token='123456:loadtest', workers=workers, base_url=api_url).run(app)
+    server = make_server('localhost', 0, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://localhost:{server.server_port}/api', server
+
+
+def make_session(concurrency: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    return session
+
+
+def send_update(session: requests.Session, url: str, command: str, idx: int, timeout: float) -> tuple:
+    chat_id = CHAT_ID_BASE + idx
+    update = build_update(command, idx + 1, chat_id)
+    sent = time.perf_counter()
+    try:
+        status = session.post(url, json=update, timeout=timeout).status_code
+    except requests.RequestException:
+        status = None
+    return chat_id, command, sent, time.perf_counter() - sent, status
+
+
+def wait_replies(api: FakeTelegramApi, chat_ids: List[int], drain_sec: float):
+    deadline = time.perf_counter() + drain_sec
+    while time.perf_counter() < deadline:
+        if all(api.reply_time(chat_id) is not None for chat_id in chat_ids):
+            return
+        time.sleep(0.05)
+
+
+def run_load(url: str, api: FakeTelegramApi, mix: List[Tuple[str, float]], rate: float, duration: float,
+             concurrency: int, timeout: float, drain_sec: float, seed: int = 0) -> dict:
+    session = make_session(concurrency)
+    rng = random.Random(seed)
+    commands = [command for command, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    # every command once first, the first chart of a process also loads matplotlib
+    warmup = [send_update(session, url, command, idx, timeout) for idx, command in enumerate(commands)]
+    wait_replies(api, [chat_id for chat_id, *_ in warmup], drain_sec)
+
+    total = int(rate * duration)
+    first_idx = len(commands)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for idx in range(total):
+            delay = start + idx / rate - time.perf_counter()  # open loop, slow answers do not lower the rate
+            if delay > 0:
+                time.sleep(delay)
+            command = rng.choices(commands, weights)[0]
+            futures.append(executor.submit(send_update, session, url, command, first_idx + idx, timeout))
+        results = [future.result() for future in futures]
+    send_elapsed = time.perf_counter() - start
+
+    accepted = [result for result in results if result[4] == 200]
+    wait_replies(api, [chat_id for chat_id, *_ in accepted], drain_sec)
+
+    replies = {}  # command -> reply latencies
+    last_reply = start
+    for chat_id, command, sent, _, _ in accepted:
+        reply_time = api.reply_time(chat_id)
+        if reply_time is not None:
+            replies.setdefault(command, []).append(reply_time - sent)
+            last_reply = max(last_reply, reply_time)
+
+    statuses = {}
+    for result in results:
+        statuses[result[4]] = statuses.get(result[4], 0) + 1
+    return {'sent': len(results),
+            'send_elapsed': send_elapsed,
+            'statuses': statuses,
+            'ack': [result[3] for result in results if result[4] is not None],
+            'replies': replies,
+            'reply_elapsed': last_reply - start}
+
+
+def print_report(report: dict, api: FakeTelegramApi):
+    sent = report['sent']
+    print(f'Sent {sent} updates in {report["send_elapsed"]:.1f} s ({sent / report["send_elapsed"]:.1f}/s), '
+          f'status codes: {report["statuses"]}')
+    print(f'Webhook ack: {format_latency(report["ack"])}')
+
+    all_replies = [value for values in report['replies'].values() for value in values]
+    print(f'Reply: {format_latency(all_replies)}')
+    if all_replies:
+        print(f'Replied {len(all_replies)} of {sent}, throughput {len(all_replies) / report["reply_elapsed"]:.1f}/s')
+    for command, values in sorted(report['replies'].items()):
+        print(f'  {command:24s} {len(values):5d}  p50 {statistics.median(values) * 1000:.1f} ms')
+    print(f'Telegram API: {api.stats()}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='/api route of a running bot, the bot runs in this process if not given')
+    parser.add_argument('--rate', type=float, default=20, help='updates per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--mix', default=MIX)
+    parser.add_argument('--concurrency', type=int, default=64, help='webhook requests in flight')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--drain', type=float, default=60, help='seconds to wait for replies after sending')
+    parser.add_argument('--api-port', type=int, default=8081, help='port of the fake Telegram API')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds added to every api answer')
+    parser.add_argument('--workers', type=int, default=4, help='render workers of the in-process bot')
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--days', type=int, default=120)
+    args = parser.parse_args()
+
+    api = FakeTelegramApi(port=args.api_port, latency_sec=args.api_latency)
+    api_url = api.start()
+    with tempfile.TemporaryDirectory() as work_dir:
+        url, server = (args.url, None) if args.url else start_bot(api_url, args.workers, args.countries, args.days,
+                                                                  work_dir)
+        try:
+            report = run_load(url, api, parse_mix(args.mix), args.rate, args.duration, args.concurrency,
+                              args.timeout, args.drain)
+            print_report(report, api)
+        finally:
+            if server is not None:
+                server.shutdown()
+            api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,23 @@
 import os
 
 import requests
-from bottle import Bottle
+from bottle import Bottle, response
 
+import instrumentation
 import io_utils
+import refresher
+
+io_utils.configure_matplotlib()  # before anything loads matplotlib
+
 from tg_bot_handler import TelegramBot
 
 token, webhook_url = io_utils.read_system_credentials()
 app = Bottle(False)
-tg_bot = TelegramBot(token=token)
+tg_bot = TelegramBot(token=token, base_url=os.environ.get('TELEGRAM_API_URL'))  # e.g. fake_telegram_api.py
 tg_bot.run(app)
+data_refresher = refresher.DataRefresher(
+    interval_sec=float(os.environ.get('REFRESH_INTERVAL_SEC', refresher.REFRESH_INTERVAL_SEC)))
+data_refresher.start()
 
 
 @app.get('/test')
@@ -19,6 +27,36 @@ def api():
     return "Completed."
 
 
+@app.get('/queue')
+def queue_stats():
+    if tg_bot.render_queue is None:
+        return {'workers': 0}
+    return tg_bot.render_queue.stats()
+
+
+@app.get('/image_cache')
+def image_cache_stats():
+    return tg_bot.image_cache.stats()
+
+
+@app.get('/refresh')
+def refresh_stats():
+    return data_refresher.stats()
+
+
+@app.post('/refresh')
+def refresh():
+    data_refresher.trigger()  # checked by the refresher thread, the answer does not wait for it
+    response.status = 202
+    return data_refresher.stats()
+
+
+@app.get('/metrics')
+def metrics():
+    response.content_type = 'text/plain; version=0.0.4; charset=utf-8'  # prometheus text format
+    return instrumentation.render_metrics()
+
+
 @app.get("/")
 def index():
     cwd = os.getcwd()
@@ -1,8 +1,6 @@
 from collections import namedtuple
 from enum import Enum, IntEnum
 
-from dataclasses import dataclass
-
 Country = namedtuple('Country', ['value', 'serverId', 'flag', 'title'])
 
 
@@ -127,15 +125,3 @@ GRAPH_TYPES = {
     GraphType.CONFIRMED_1M_PEOPLE: 'confirmed_1m_people',
     GraphType.DEATHS_RATE: 'deaths_rate'
 }
-
-
-@dataclass
-class TimeSeriesItem:
-    """Class for keeping track of an item in inventory."""
-    country: str
-    region: str
-    dates: dict
-    total: int
-
-    def get_location_name(self) -> str:
-        return self.region if not self.country else self.country
\ No newline at end of file
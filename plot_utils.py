@@ -1,179 +1,130 @@
-from collections import defaultdict
-from datetime import datetime
 from typing import Tuple, Any, Optional
 
-import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.dates import DateFormatter
 from matplotlib.ticker import FuncFormatter
 
-import io_utils
+import dataset
+import figure_templates
+import instrumentation
+import ranking
+import stats_engine
 import virus_utils
+from figure_templates import FigureTemplate
 from models import StatType, Country
 
 fs = lambda m, n: [i * n // m + n // (2 * m) for i in range(m)]
 
+def setup_date_axis(ax: Any):
+    ax.xaxis_date()
+    ax.xaxis.set_major_formatter(DateFormatter("%b %d"))
+    ax.tick_params(axis='x', labelrotation=30)  # like autofmt_xdate, but kept for ticks of new data
+
+
+def setup_grid(ax: Any, **kwargs):
+    # Show the major grid lines with dark grey lines
+    ax.grid(True, which='major', color='#666666', linestyle='-', **kwargs)
 
-def parse_date(date_str: str) -> datetime:
-    group = date_str.split("-")
-    year = virus_utils.num(group[0])
-    month = virus_utils.num(group[1])
-    day = virus_utils.num(group[2])
-    return datetime(year=year, month=month, day=day)
+    ax.minorticks_on()
+    ax.grid(True, which='minor', color='#999999', linestyle='-', alpha=0.2, **kwargs)
+
+
+def setup_world_mortality_rate(template: FigureTemplate):
+    ax = template.ax
+    setup_date_axis(ax)
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: '{val:d}{suffix}'.format(val=int(y), suffix='%')))
+    setup_grid(ax)
+    ax.set_ylabel('Fatality rate')
+    ax.set_title('Fatality rate of COVID-19 pandemic')
+    template.fig.subplots_adjust(bottom=0.2)
 
 
-def generate_world_mortality_rate_10() -> Optional[Tuple[Any, Any]]:
-    data = virus_utils.fetch_pomper_stat()
+@instrumentation.timed()
+def generate_world_mortality_rate_10(data: dataset.Dataset = None) -> Optional[Tuple[Any, Any]]:
+    data = get_data(data)
     if data is None:
-        print('Data is not found')
         return None
 
-    dct = defaultdict(float)
-    dct_dates = defaultdict(list)
-    data_items = data.items()
-    for country_title, dates in data_items:
-        if country_title == 'MS Zaandam':
-            continue  # skip ship liner
-        latest_date = dates[-1]
-        confirmed = latest_date[StatType.CONFIRMED.to_data_name()]  # just last element
-        deaths = latest_date[StatType.DEATHS.to_data_name()]  # just last element
-        if confirmed == 0: continue
-        mortality_rate: float = deaths / confirmed
-        dct[country_title] = mortality_rate
-        dct_dates[country_title] = dates
-
-    sorted_dict = sorted(dct.items(), key=lambda k_v: k_v[1], reverse=True)
-    most_areas = sorted_dict[:10]  # 10 most countries
-
-    fig, ax = plt.subplots()
-
-    for k, v in most_areas:
-        country_title = k
-        country_data = dct_dates[k]
-        if country_data is not None:
-            x = []
-            y = []
-            for date in country_data:
-                confirmed = date[StatType.CONFIRMED.to_data_name()]  # just last element
-                deaths = date[StatType.DEATHS.to_data_name()]  # just last element
-                if confirmed == 0: continue
-                mortality_rate: float = deaths / confirmed
-
-                cell_value = mortality_rate * 100  # convert to percent
-                date_str: str = date['date']
-                dt: datetime = parse_date(date_str)
-                x.append(dt)
-                y.append(cell_value)
-
-            ax.plot(x, y, label=country_title)  # for each country
+    mortality_rate = stats_engine.get_metrics(data).fatality_rate
+    most_areas = ranking.get_ranking(data).top_fatality_rate()  # 10 most countries
 
-    ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: '{val:d}{suffix}'.format(val=int(y), suffix='%')))
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-    fig.autofmt_xdate()  # Rotate date labels automatically
+    lines = []
+    for row in most_areas:
+        mask = ~np.isnan(mortality_rate[row])
+        lines.append((data.dates[mask], mortality_rate[row][mask] * 100, data.countries[row], {}))  # to percent
 
-    # Show the major grid lines with dark grey lines
-    plt.grid(b=True, which='major', color='#666666', linestyle='-')
+    template = figure_templates.get_template('world_mortality_rate', setup_world_mortality_rate)
+    template.set_lines(lines)
 
-    plt.minorticks_on()
-    plt.grid(b=True, which='minor', color='#999999', linestyle='-', alpha=0.2)
+    date_update_str = data.updated_label
+    template.ax.set_xlabel(f'Day\nData updated: {date_update_str}')
+    template.ax.legend(loc="upper left")
+    return template.fig, template.ax
 
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
-    plt.xlabel(f'Day\nData updated: {date_update_str}')
-    plt.ylabel('Fatality rate')
-    plt.legend(loc="upper left")
 
-    ax.set_title('Fatality rate of COVID-19 pandemic')
-    return fig, ax
+def setup_world_stat_10(template: FigureTemplate):
+    ax = template.ax
+    setup_date_axis(ax)
+    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
+    setup_grid(ax)
+    template.fig.subplots_adjust(bottom=0.2)
 
 
+@instrumentation.timed()
 def generate_world_stat_10(stat_type: StatType, active: bool = False, country: Country = None,
-                           ax: any = None) -> Optional[
+                           ax: any = None, data: dataset.Dataset = None) -> Optional[
     Tuple[Any, Any]]:
-    data = virus_utils.fetch_pomper_stat()
+    data = get_data(data)
     if data is None:
-        print('Data is not found')
         return None
 
     most_areas = get_most_countries(data, stat_type)
-    if ax is None:
-        fig, ax = plt.subplots()
-    else:
-        fig = None
 
+    daily = stats_engine.get_metrics(data).daily[:, :, stat_type] if active else None
     country_data = None
-    for k, v in most_areas:
-        x = []
-        y = []
-        idx = -1
-        dates = v[0]['dates']
-        for date in dates:
-            idx = idx + 1
-            cell_value = virus_utils.num(date[stat_type.to_data_name()])
-
-            add_val: int
-            if active:
-                if cell_value < 1:
-                    continue
-                # since api means only total values
-                cell_value_prev = cell_value if idx == 0 else virus_utils.num(
-                    dates[idx - 1][stat_type.to_data_name()])
-                actual_diff = cell_value if idx == 0 else max(cell_value - cell_value_prev, 0)
-                add_val = actual_diff
-            else:
-                add_val = cell_value
-            y.append(add_val)
-
-            date_str = date['date']
-            dt = parse_date(date_str)
-            x.append(dt)
+    lines = []
+    for row in most_areas:
+        series = data.series(row, stat_type)
+        if active:
+            mask = series >= 1
+            x = data.dates[mask]
+            y = daily[row][mask]  # since api means only total values
+        else:
+            x = data.dates
+            y = series
 
-        country_title = v[0]['title']
+        country_title = data.countries[row]
         line_width = 1
         if country is not None:  # highlight country line
             if country.serverId == country_title:
                 line_width = 2.5
-                country_data = dates
+                country_data = series
             else:
                 line_width = 0.8
 
-        ax.plot(x, y, linewidth=line_width, label=country_title)  # for each country
+        lines.append((x, y, country_title, {'linewidth': line_width}))  # for each country
 
     # calc values
     avg = 0
-    if country_data is not None:
-        count = 0
-        summa = 0
-        cell_value_prev = 0
-        for date in country_data[::-1]:
-            if count > 7:
-                break
-            cell_value = virus_utils.num(date[stat_type.to_data_name()])
-            if count > 0:
-                actual_diff = abs(cell_value_prev - cell_value)
-                summa = summa + actual_diff
-
-            cell_value_prev = cell_value
-            count = count + 1
-
-        avg = 0 if count == 0 else summa // count
-
-    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-
-    if fig is not None:
-        fig.autofmt_xdate()  # Rotate date labels automatically
-
-    # Show the major grid lines with dark grey lines
-    ax.grid(b=True, which='major', color='#666666', linestyle='-')
+    if country_data is not None and len(country_data) > 0:
+        last_week = country_data[-8:]
+        avg = int(np.abs(np.diff(last_week)).sum()) // len(last_week)
 
-    ax.minorticks_on()
-    ax.grid(b=True, which='minor', color='#999999', linestyle='-', alpha=0.2)
-
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
-    plt.xlabel(f'Day\nData updated: {date_update_str}')
-    plt.ylabel(stat_type.to_title().title())
+    if ax is None:
+        template = figure_templates.get_template(('world_stat_10', stat_type, active), setup_world_stat_10)
+        template.set_lines(lines)
+        fig, ax = template.fig, template.ax
+    else:  # draw on the axes of the caller
+        fig = None
+        for x, y, label, style in lines:
+            ax.plot(x, y, label=label, **style)
+        ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
+        ax.xaxis.set_major_formatter(DateFormatter("%b %d"))
+        setup_grid(ax)
+
+    date_update_str = data.updated_label
+    ax.set_xlabel(f'Day\nData updated: {date_update_str}')
+    ax.set_ylabel(stat_type.to_title().title())
     ax.legend(loc='best')
 
     country_label = '10 Most Countries' if country is None else f'{country.title} (avg per last 7 days = {avg})'
@@ -181,422 +132,289 @@ def generate_world_stat_10(stat_type: StatType, active: bool = False, country: C
     return fig, ax
 
 
-def show_deaths_stat_10(stat_type: StatType):
-    generate_world_stat_10(stat_type)
-    plt.show()
+def setup_bar_world_stat_10(template: FigureTemplate):
+    ax = template.ax
+    # format big values
+    ax.xaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    template.fig.set_tight_layout(True)  # country names change, layout is recomputed on each draw
 
 
-def generate_bar_world_stat_10(stat_type: StatType) -> Optional[Tuple[Any, Any]]:
-    data = virus_utils.fetch_pomper_stat()
+@instrumentation.timed()
+def generate_bar_world_stat_10(stat_type: StatType, data: dataset.Dataset = None) -> Optional[Tuple[Any, Any]]:
+    data = get_data(data)
     if data is None:
-        print('Data is not found')
         return None
 
-    dct = defaultdict(list)
-    for country_title, dates in data.items():
-        total = dates[-1][stat_type.to_data_name()]  # just last element
-        dct[total].append(country_title)
-
-    sorted_dict = sorted(dct.items(), reverse=True)
-    most_areas = sorted_dict[:10]  # 10 most countries
+    most_areas = get_most_countries(data, stat_type)
     most_areas.reverse()  # show most first
 
-    x = []
-    y = []
-    for num, count in most_areas:
-        title = count[0]
-        x.append(title)
-        y.append(int(num))
-
-    y_pos = np.arange(len(x))
+    latest = data.latest(stat_type)
+    x = [data.countries[row] for row in most_areas]
+    y = [int(latest[row]) for row in most_areas]
 
-    fig, ax = plt.subplots()
-    ax.barh(y_pos, y, align='center', alpha=0.5)
-
-    ax.set_yticklabels(x)
-    ax.set_yticks(np.arange(len(x)))
-
-    # format big values
-    ax.xaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
+    template = figure_templates.get_template(('bar_world_stat_10', stat_type), setup_bar_world_stat_10)
+    template.set_barh(x, y, lambda count: " " + f'{count:,}')  # print big nums with comma
 
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
+    ax = template.ax
+    date_update_str = data.updated_label
     ax.set_xlabel(f'{stat_type.to_title().title()}\nData updated: {date_update_str}')
     ax.set_title(f'{stat_type.to_title().title()} statistics – 10 Most Countries')
+    return template.fig, ax
 
-    for i, count in enumerate(y):
-        ax.text(count, i, " " + f'{count:,}', color='black', va='center')  # print big nums with comma
 
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    plt.tight_layout()
-    return fig, ax
+def get_data(data: Optional[dataset.Dataset]) -> Optional[dataset.Dataset]:
+    """The dataset a chart is drawn from, the published one if the caller did not pin a version"""
+    if data is None:
+        data = virus_utils.fetch_dataset()
+        if data is None:
+            print('Data is not found')
+    return data
 
 
-def fetch_country_data(country: Country) -> Optional[any]:
-    data = virus_utils.fetch_pomper_stat()
+def fetch_country_data(country: Country, data: dataset.Dataset = None) -> Optional[Tuple[dataset.Dataset, int]]:
+    """Returns the dataset and the row of the country in it"""
+    data = get_data(data)
     if data is None:
-        print('Data is not found')
         return None
 
     country_id = country.serverId
-    country = data.get(country_id)
-    if country is None:
+    row = data.row(country_id)
+    if row is None:
         print(f'Country {country_id} not found')
         return None
-    return country
+    return data, row
+
+
+def setup_country_plot(template: FigureTemplate):
+    ax = template.ax
+    setup_date_axis(ax)
+    ax.grid(zorder=0)
+    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
+    template.fig.set_tight_layout(True)
 
 
-def get_datetime_obj(item: any) -> datetime:
-    date_str = item['date']
-    return parse_date(date_str)
+def set_country_lines(template: FigureTemplate, x: np.ndarray, y: np.ndarray, y_recovered: Any,
+                      stat_type: StatType, line_width: float):
+    """Stat line of a country, with recovered next to it if given"""
+    lines = [(x, y, stat_type.to_title().title(), {'linewidth': line_width})]
+    if len(y_recovered) > 0:
+        lines.append((x, y_recovered, StatType.RECOVERED.to_title().title(), {'linewidth': line_width}))
+    template.set_lines(lines)
+
+    legend = template.ax.get_legend()
+    if len(lines) > 1:
+        template.ax.legend(loc="upper left")
+    elif legend is not None:
+        legend.remove()
 
 
-def generate_country_active_plot(country: Country, stat_type: StatType) -> Optional[Tuple[Any, Any]]:
-    country_data = fetch_country_data(country)
+@instrumentation.timed()
+def generate_country_active_plot(country: Country, stat_type: StatType,
+                                 data: dataset.Dataset = None) -> Optional[Tuple[Any, Any]]:
+    country_data = fetch_country_data(country, data)
     if country_data is None:
         return None
+    data, row = country_data
     country_name = country.title
 
-    fig, ax = plt.subplots()
-    x = []
-    y = []
+    series = data.series(row, stat_type)
+    daily = stats_engine.get_metrics(data).daily[row]  # since api means only total values
+    mask = (series >= 1) & (daily[:, stat_type] != 0)
+    x = data.dates[mask]
+    y = daily[:, stat_type][mask]
     y_recovered = []
-    for idx, item in enumerate(country_data):
-        cell_value = virus_utils.num(item[stat_type.to_data_name()])
-        if cell_value < 1:
-            continue
-        # since api means only total values
-        cell_value_prev = cell_value if idx == 0 else virus_utils.num(country_data[idx - 1][stat_type.to_data_name()])
-        actual_diff = cell_value if idx == 0 else max(cell_value - cell_value_prev, 0)
-        if actual_diff == 0:  # skip
-            continue
+    if stat_type == StatType.CONFIRMED:
+        y_recovered = daily[:, StatType.RECOVERED][mask]
 
-        dt = get_datetime_obj(item)
-        x.append(dt)
-        y.append(actual_diff)
+    template = figure_templates.get_template(('country_active', stat_type), setup_country_plot)
+    set_country_lines(template, x, y, y_recovered, stat_type, 1.5)
 
-        if stat_type == StatType.CONFIRMED:
-            cell_value_r = virus_utils.num(item[StatType.RECOVERED.to_data_name()])
-            cell_value_prev_r = cell_value_r if idx == 0 else virus_utils.num(
-                country_data[idx - 1][StatType.RECOVERED.to_data_name()])
-            actual_diff_r = cell_value_r if idx == 0 else max(cell_value_r - cell_value_prev_r, 0)
-            y_recovered.append(actual_diff_r)
-
-    ax.plot(x, y, marker='', linewidth=1.5, label=stat_type.to_title().title())  # for each country
-    if len(y_recovered) > 0:
-        ax.plot(x, y_recovered, marker='', linewidth=1.5,
-                label=StatType.RECOVERED.to_title().title())  # for each country
-        plt.legend(loc="upper left")
-
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
-    plt.xlabel(f'Data updated: {date_update_str}')
+    ax = template.ax
+    date_update_str = data.updated_label
+    ax.set_xlabel(f'Data updated: {date_update_str}')
 
     ax.set_ylabel(stat_type.to_title().title())
     ax.set_title(f'{country_name} – Daily {stat_type.to_title().title()}')
+    return template.fig, ax
 
-    ax.xaxis_date()
-    ax.grid(zorder=0)
-
-    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-    fig.autofmt_xdate()  # Rotate date labels automatically
 
-    # draw_text_bar_vert(bar)
-    plt.tight_layout()
-    return fig, ax
+def setup_country_per_million(template: FigureTemplate):
+    ax = template.ax
+    setup_date_axis(ax)
+    ax.grid(zorder=0)
+    template.fig.set_tight_layout(True)
 
 
-def generate_country_active_plot_per_million(country: Country, stat_type: StatType) -> Optional[
+@instrumentation.timed()
+def generate_country_active_plot_per_million(country: Country, stat_type: StatType,
+                                             data: dataset.Dataset = None) -> Optional[
     Tuple[Any, Any]]:
-    country_data = fetch_country_data(country)
+    country_data = fetch_country_data(country, data)
     if country_data is None:
         return None
+    data, row = country_data
 
     country_name = country.title
-    fig, ax = plt.subplots()
-
-    people = io_utils.get_population(country_name)
-    if people == 0:  # no such country
+    metrics = stats_engine.get_metrics(data)
+    if metrics.population[row] == 0:  # no such country
         return None
-    person_per_million = people // 1_000_000  # e.g. Russia: 145
-    op_calc_val = lambda y: return_per_million_val(y, person_per_million)
-    x, y = get_axis_avg_week_plot(country_data, stat_type, op_calc_val, False)
 
-    ax.plot(x, y, marker='', color='#EF7028', linewidth=2.5, label=country_name)  # for each country
+    x, y = get_axis_avg_week_plot(data.dates, metrics.per_million[row, :, stat_type], False)
 
+    template = figure_templates.get_template(('country_per_million', stat_type), setup_country_per_million)
+    template.set_lines([(x, y, country_name, {'color': '#EF7028', 'linewidth': 2.5})])
+
+    ax = template.ax
     ax.set_ylabel(stat_type.to_title().title())
     ax.set_title(f'{country_name} – Daily {stat_type.to_title().title()} per million inhabitants')
-    ax.xaxis_date()
-    ax.grid(zorder=0)
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-    fig.autofmt_xdate()  # Rotate date labels automatically
-
-    plt.tight_layout()
-    return fig, ax
-
+    return template.fig, ax
 
-def get_plot_country_per_million(country_data: list, stat_type: StatType, person_per_million: int, fun, *args,
-                                 use_date=False):
-    x = []
-    y = []
-    counter = 0
-    for idx, item in enumerate(country_data):
-        cell_value = virus_utils.num(item[stat_type.to_data_name()])
-        if cell_value < 1:
-            continue
-        # since api means only total values
-        cell_value_prev = cell_value if idx == 0 else virus_utils.num(country_data[idx - 1][stat_type.to_data_name()])
-        actual_diff = cell_value if idx == 0 else max(cell_value - cell_value_prev, 0)
-        if actual_diff == 0:  # skip
-            continue
-
-        cases_per_million = actual_diff // person_per_million  # Russia avg=10k, 10k / 145
-        if cases_per_million < 3:  # show only those that reached 3 cases per million
-            continue
 
-        if use_date:
-            dt = get_datetime_obj(item)
-            x.append(dt)
-        else:
-            counter = counter + 1
-            x.append(counter)
-        y.append(cases_per_million)
-    return x, y
+def setup_world_stat_10_per_million(template: FigureTemplate):
+    ax = template.ax
+    setup_grid(ax)
+    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
 
 
-def generate_world_stat_10_per_million(stat_type: StatType) -> Optional[Tuple[Any, Any]]:
-    data = virus_utils.fetch_pomper_stat()
+@instrumentation.timed()
+def generate_world_stat_10_per_million(stat_type: StatType, data: dataset.Dataset = None) -> Optional[Tuple[Any, Any]]:
+    data = get_data(data)
     if data is None:
-        print('Data is not found')
         return None
 
     most_areas = get_most_countries(data, stat_type)
-    fig, ax = plt.subplots()
 
-    for k, v in most_areas:
-        country_name = v[0]['title']
-        dates = v[0]['dates']
-        people = io_utils.get_population(country_name)
-        if people == 0:  # no such country
+    metrics = stats_engine.get_metrics(data)
+    per_million = metrics.per_million[:, :, stat_type]
+    lines = []
+    for row in most_areas:
+        country_name = data.countries[row]
+        if metrics.population[row] == 0:  # no such country
             continue
-        person_per_million = people // 1_000_000  # e.g. Russia: 145
-
-        # pass custom function to calc Y value
-        op_calc_val = lambda y: return_per_million_val(y, person_per_million)
-        x, y = get_axis_avg_week_plot(dates, stat_type, op_calc_val, False)
+        x, y = get_axis_avg_week_plot(data.dates, per_million[row], False)
+        lines.append((x, y, country_name, {}))  # for each country
 
-        ax.plot(x, y, label=country_name)  # for each country
+    template = figure_templates.get_template(('world_stat_10_per_million', stat_type),
+                                             setup_world_stat_10_per_million)
+    template.set_lines(lines)
 
+    ax = template.ax
     ax.set_ylabel(stat_type.to_title().title())
     ax.set_title(f'Daily COVID-19 {stat_type.to_title().title()} per million inhabitants')
 
-    # Show the major grid lines with dark grey lines
-    plt.grid(b=True, which='major', color='#666666', linestyle='-')
-
-    plt.minorticks_on()
-    plt.grid(b=True, which='minor', color='#999999', linestyle='-', alpha=0.2)
-
-    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
-
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
-    plt.xlabel(
+    date_update_str = data.updated_label
+    ax.set_xlabel(
         f'Day number after reaching 3 {stat_type.to_title().lower()} per million inhabitants\nData updated: {date_update_str}')
-    plt.legend(loc="upper left", prop={'size': 10})
-    return fig, ax
-
-
-def return_input_arg(val: int) -> int:
-    return val
-
-
-def return_per_million_val(val: int, person_per_million: int) -> int:
-    return val // person_per_million  # e.g. Russia avg in May cases=10k, 10k / 145
-
-
-def get_axis_avg_week_plot(country_data: list, stat_type: StatType, op_calc_val=lambda y: return_input_arg(y),
-                           use_date: bool = True):
-    x = []
-    y = []
-    avg_y = []
-    summa = 0
-    window_size = 7
+    ax.legend(loc="upper left", prop={'size': 10})
+    return template.fig, ax
 
-    counter = 0
-    skip_first_empty = True  # skip first empty data
-    for idx, item in enumerate(country_data):
-        counter = counter + 1
-        cell_value = virus_utils.num(item[stat_type.to_data_name()])
-        if skip_first_empty and cell_value < 1:
-            continue
-
-        skip_first_empty = False
-        # since api means only total values
-        cell_value_prev = cell_value if idx == 0 else virus_utils.num(country_data[idx - 1][stat_type.to_data_name()])
-        actual_diff = cell_value if idx == 0 else max(cell_value - cell_value_prev, 0)
-        if actual_diff == 0:  # skip
-            continue
-
-        index = len(y)
-        y.append(actual_diff)
 
-        summa = summa + actual_diff
-        if index >= window_size:
-            summa = summa - y[index - window_size]  # throw away first edge
-            avg_val = summa // window_size
-        else:
-            avg_val = summa // len(y)
+def get_axis_avg_week_plot(dates: np.ndarray, avg: np.ndarray, use_date: bool = True):
+    """Points of a rolling average series that reached 3, x is the date or the day number in the dataset"""
+    mask = avg >= 3  # skip almost empty values, nan never passes
+    y = avg[mask]
+    x = dates[mask] if use_date else np.flatnonzero(mask) + 1
+    return x, y
 
-        output = op_calc_val(avg_val)
-        if output < 3:  # skip almost empty values
-            continue
 
-        if use_date:
-            dt = get_datetime_obj(item)
-            x.append(dt)
-        else:
-            x.append(counter)
-        avg_y.append(output)
-
-    return x, avg_y
+def setup_toll_plot_avg(template: FigureTemplate):
+    ax = template.ax
+    setup_date_axis(ax)
+    setup_grid(ax, zorder=0)
+    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
+    template.fig.subplots_adjust(bottom=0.2)
 
 
-def generate_country_toll_plot_avg(country: Country, stat_type: StatType) -> Optional[Tuple[Any, Any]]:
-    country_data = fetch_country_data(country)
+@instrumentation.timed()
+def generate_country_toll_plot_avg(country: Country, stat_type: StatType,
+                                   data: dataset.Dataset = None) -> Optional[Tuple[Any, Any]]:
+    country_data = fetch_country_data(country, data)
     if country_data is None:
         return None
+    data, row = country_data
     country_name = country.title
 
-    fig, ax = plt.subplots()
+    avg = stats_engine.get_metrics(data).rolling_mean[row, :, stat_type]
+    x, avg_y = get_axis_avg_week_plot(dates=data.dates, avg=avg, use_date=True)
 
-    x, avg_y = get_axis_avg_week_plot(country_data=country_data, stat_type=stat_type, use_date=True)
-    ax.plot(x, avg_y, marker='', color='#EF7028', linewidth=2.5, label=country_name)  # for each country
+    template = figure_templates.get_template(('country_toll_plot_avg', stat_type), setup_toll_plot_avg)
+    template.set_lines([(x, avg_y, country_name, {'color': '#EF7028', 'linewidth': 2.5})])
 
+    ax = template.ax
     ax.set_ylabel(stat_type.to_title().title())
     ax.set_title(f'{country_name} – {stat_type.to_title().title()} (7-day rolling average)')
-    ax.xaxis_date()
-
-    # Show the major grid lines with dark grey lines
-    plt.grid(zorder=0, b=True, which='major', color='#666666', linestyle='-')
-
-    plt.minorticks_on()
-    plt.grid(zorder=0, b=True, which='minor', color='#999999', linestyle='-', alpha=0.2)
-
-    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-    fig.autofmt_xdate()  # Rotate date labels automatically
-    return fig, ax
-
+    return template.fig, ax
 
-def get_most_countries(data: any, stat_type: StatType) -> list:
-    # get only 10 most countries
-    dct = defaultdict(list)
-    for country_title, dates in data.items():
-        total = dates[-1][stat_type.to_data_name()]  # just last element
-        dct[total].append({'title': country_title, 'dates': dates})
 
-    sorted_dict = sorted(dct.items(), reverse=True)
-    return sorted_dict[:10]  # 10 most countries
+def get_most_countries(data: dataset.Dataset, stat_type: StatType, n: int = ranking.TOP_COUNT) -> list:
+    """Rows of the countries with the largest latest total"""
+    return ranking.get_ranking(data).top_total(stat_type, n)
 
 
-def generate_toll_plot_avg(stat_type: StatType) -> Optional[Tuple[Any, Any]]:
-    data = virus_utils.fetch_pomper_stat()
+@instrumentation.timed()
+def generate_toll_plot_avg(stat_type: StatType, data: dataset.Dataset = None) -> Optional[Tuple[Any, Any]]:
+    data = get_data(data)
     if data is None:
-        print('Data is not found')
         return None
 
     # get only 10 most countries
     most_areas = get_most_countries(data, stat_type=stat_type)
 
-    fig, ax = plt.subplots()
-    for k, v in most_areas:
-        country_name = v[0]['title']
-        country_data = v[0]['dates']
+    rolling_mean = stats_engine.get_metrics(data).rolling_mean[:, :, stat_type]
+    lines = []
+    for row in most_areas:
+        country_name = data.countries[row]
 
-        x, avg = get_axis_avg_week_plot(country_data=country_data, stat_type=stat_type, use_date=True)
-        ax.plot(x, avg, label=country_name)  # for each country
+        x, avg = get_axis_avg_week_plot(dates=data.dates, avg=rolling_mean[row], use_date=True)
+        lines.append((x, avg, country_name, {}))  # for each country
 
-        # draw text of the country near the last point
-        # if len(x) > 0:
-        #  point = (x[len(x) - 1], avg[len(avg) - 1])
-        #  ax.annotate(country_name, point)
+    template = figure_templates.get_template(('toll_plot_avg', stat_type), setup_toll_plot_avg)
+    template.set_lines(lines)
 
+    ax = template.ax
     ax.set_ylabel(stat_type.to_title().title())
     ax.set_title(f'{stat_type.to_title().title()} (7-day rolling average)')
 
-    ax.xaxis_date()
-
-    # Show the major grid lines with dark grey lines
-    plt.grid(zorder=0, b=True, which='major', color='#666666', linestyle='-')
-
-    plt.minorticks_on()
-    plt.grid(zorder=0, b=True, which='minor', color='#999999', linestyle='-', alpha=0.2)
+    date_update_str = data.updated_label
+    ax.set_xlabel(f'Day\nData updated: {date_update_str}')
+    ax.legend(loc="upper left")
+    return template.fig, ax
 
-    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-    fig.autofmt_xdate()  # Rotate date labels automatically
 
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
-    plt.xlabel(f'Day\nData updated: {date_update_str}')
-    plt.legend(loc="upper left")
-    return fig, ax
-
-
-def draw_text_bar_vert(bar: Any):
+def draw_text_bar_vert(ax: Any, bar: Any):
     # Add counts above the two bar graphs
     for rect in bar:
         height = rect.get_height()
-        plt.text(rect.get_x() + rect.get_width() / 2.0, height, '%d' % int(height), ha='center', va='bottom')
+        ax.text(rect.get_x() + rect.get_width() / 2.0, height, '%d' % int(height), ha='center', va='bottom')
 
 
-def generate_country_total_plot(country: Country, stat_type: StatType) -> Optional[
+@instrumentation.timed()
+def generate_country_total_plot(country: Country, stat_type: StatType, data: dataset.Dataset = None) -> Optional[
     Tuple[Any, Any]]:
     # show_only_weeks = stat_type == StatType.CONFIRMED  # too much data to draw
-    country_data = fetch_country_data(country)
+    country_data = fetch_country_data(country, data)
     if country_data is None:
         return None
+    data, row = country_data
     country_name = country.title
 
-    fig, ax = plt.subplots()
-    x = []
-    y = []
+    series = data.series(row, stat_type)
+    mask = series >= 1
+    x = data.dates[mask]
+    y = series[mask]
     y_recovered = []
-    for item in country_data:
-        cell_value = virus_utils.num(item[stat_type.to_data_name()])
-        if cell_value < 1:
-            continue
+    if stat_type == StatType.CONFIRMED:
+        y_recovered = data.series(row, StatType.RECOVERED)[mask]
 
-        dt = get_datetime_obj(item)
-        x.append(dt)
+    template = figure_templates.get_template(('country_total', stat_type), setup_country_plot)
+    set_country_lines(template, x, y, y_recovered, stat_type, 2)
 
-        # if show_only_weeks is False or dt.weekday() == 0:  # monday only or add all, decrease data
-        y.append(cell_value)
-
-        if stat_type == StatType.CONFIRMED:
-            val_recovered = virus_utils.num(item[StatType.RECOVERED.to_data_name()])
-            y_recovered.append(val_recovered)
-
-    ax.yaxis.set_major_formatter(FuncFormatter(virus_utils.reformat_large_tick_values))
-
-    ax.plot(x, y, marker='', linewidth=2, label=stat_type.to_title().title())  # for each country
-    if len(y_recovered) > 0:
-        ax.plot(x, y_recovered, marker='', linewidth=2, label=StatType.RECOVERED.to_title().title())  # for each country
-        plt.legend(loc="upper left")
-
-    date_update_str = virus_utils.get_formatted_datetime_change_data()
-    plt.xlabel(f'Data updated: {date_update_str}')
+    ax = template.ax
+    date_update_str = data.updated_label
+    ax.set_xlabel(f'Data updated: {date_update_str}')
 
     ax.set_ylabel(stat_type.to_title().title())
     ax.set_title(f'{country_name} – {stat_type.to_title().title()} Total statistics')
-
-    ax.xaxis_date()
-    ax.grid(zorder=0)
-    my_fmt = DateFormatter("%b %d")
-    ax.xaxis.set_major_formatter(my_fmt)
-    fig.autofmt_xdate()  # Rotate date labels automatically
-
-    plt.tight_layout()
-    return fig, ax
+    return template.fig, ax
@@ -0,0 +1,95 @@
+import atexit
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+CACHE_SIZE = 10_000  # users kept in memory per process
+FLUSH_SIZE = 50  # pending writes that trigger an immediate flush
+FLUSH_INTERVAL_SEC = 1.0  # longest time a write waits in memory
+
+
+class PrefStore:
+    """
+    User preferences in SQLite (WAL mode) shared by all worker processes.
+    Reads go through an in-process LRU cache which is dropped whenever another process commits,
+    writes are collected and committed in batches.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # user_id -> country value or None if not set
+        self.pending = {}  # user_id -> country value waiting for commit
+        self.flush_timer = None
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pref_country '
+                          '(user_id INTEGER PRIMARY KEY, country TEXT NOT NULL, updated INTEGER NOT NULL)')
+        self.data_version = self.read_data_version()
+        atexit.register(self.flush)
+
+    def read_data_version(self) -> int:
+        # changes only when another connection commits
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def cache_put(self, user_id: int, country: Optional[str]):
+        self.cache[user_id] = country
+        self.cache.move_to_end(user_id)
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def get(self, user_id: int) -> Optional[str]:
+        with self.lock:
+            country = self.pending.get(user_id)
+            if country is not None:
+                return country
+
+            data_version = self.read_data_version()
+            if data_version != self.data_version:
+                self.cache.clear()  # other workers changed preferences
+                self.data_version = data_version
+
+            if user_id in self.cache:
+                self.cache.move_to_end(user_id)
+                return self.cache[user_id]
+
+            row = self.conn.execute('SELECT country FROM pref_country WHERE user_id = ?', (user_id,)).fetchone()
+            country = None if row is None else row[0]
+            self.cache_put(user_id, country)
+            return country
+
+    def put(self, user_id: int, country: str):
+        with self.lock:
+            self.pending[user_id] = country
+            self.cache_put(user_id, country)
+            if len(self.pending) >= FLUSH_SIZE:
+                self.flush_locked()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer(FLUSH_INTERVAL_SEC, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.pending:
+            return
+        now = int(time.time())
+        rows = [(user_id, country, now) for user_id, country in self.pending.items()]
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('INSERT INTO pref_country (user_id, country, updated) VALUES (?, ?, ?) '
+                                  'ON CONFLICT(user_id) DO UPDATE SET country = excluded.country, '
+                                  'updated = excluded.updated', rows)
+            self.conn.execute('COMMIT')
+        except sqlite3.Error:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.pending.clear()
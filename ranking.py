@@ -0,0 +1,80 @@
+import threading
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+import dataset
+import stats_engine
+from models import StatType
+
+TOP_COUNT = 10  # countries shown on world charts
+MAX_RANK = 50  # longest ranking kept in the index, larger requests are clamped
+
+RATE_EXCLUDED = {'MS Zaandam'}  # ship liner, its fatality rate is not comparable with countries
+
+
+def top_k(scores: np.ndarray, k: int, valid: np.ndarray = None) -> np.ndarray:
+    """Rows of the k highest scores, best first, equal scores keep dataset row order"""
+    rows = np.arange(len(scores)) if valid is None else np.flatnonzero(valid)
+    candidates = scores[rows]
+    k = min(k, len(rows))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(rows):
+        # keep every row tied with the k-th score so the stable tie break below is exact
+        kth_score = np.partition(candidates, len(candidates) - k)[len(candidates) - k]
+        keep = candidates >= kth_score
+        rows = rows[keep]
+        candidates = candidates[keep]
+    order = np.lexsort((rows, -candidates))
+    return rows[order][:k]
+
+
+@dataclass(frozen=True)
+class RankingIndex:
+    """Countries ordered by latest values, computed once per data version"""
+    version: str
+    totals: Dict[StatType, np.ndarray]
+    per_million: Dict[StatType, np.ndarray]  # by the latest rolling mean per million inhabitants
+    fatality_rate: np.ndarray
+
+    def top_total(self, stat_type: StatType, n: int = TOP_COUNT) -> List[int]:
+        return self.totals[stat_type][:n].tolist()
+
+    def top_per_million(self, stat_type: StatType, n: int = TOP_COUNT) -> List[int]:
+        return self.per_million[stat_type][:n].tolist()
+
+    def top_fatality_rate(self, n: int = TOP_COUNT) -> List[int]:
+        return self.fatality_rate[:n].tolist()
+
+
+ranking_lock = threading.Lock()
+ranking_cache = {}  # dataset version -> RankingIndex
+
+
+def build_ranking(data: dataset.Dataset) -> RankingIndex:
+    metrics = stats_engine.get_metrics(data)
+    totals = {}
+    per_million = {}
+    for stat_type in StatType:
+        totals[stat_type] = top_k(data.latest(stat_type), MAX_RANK)
+        latest_per_million = metrics.per_million[:, -1, stat_type]
+        per_million[stat_type] = top_k(latest_per_million, MAX_RANK, ~np.isnan(latest_per_million))
+
+    latest_rate = metrics.fatality_rate[:, -1]
+    rated = ~np.isnan(latest_rate) & np.array([name not in RATE_EXCLUDED for name in data.countries], dtype=bool)
+    return RankingIndex(version=data.version,
+                        totals=totals,
+                        per_million=per_million,
+                        fatality_rate=top_k(latest_rate, MAX_RANK, rated))
+
+
+def get_ranking(data: dataset.Dataset) -> RankingIndex:
+    with ranking_lock:
+        ranking = ranking_cache.get(data.version)
+        if ranking is None:
+            ranking = build_ranking(data)
+            ranking_cache.clear()  # only the latest version is ever requested
+            ranking_cache[data.version] = ranking
+        return ranking
@@ -0,0 +1,99 @@
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import instrumentation
+import virus_utils
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_SEC = 30 * 60  # conditional GET of the source, cheap when nothing changed
+JITTER = 0.1  # +-10% so processes started together do not check together
+RETRY_SEC = 60  # next check after a failed one
+
+
+class DataRefresher:
+    """
+    Checks the data source in a background thread and publishes new snapshots,
+    user requests only read the latest published snapshot and never wait on the network
+    """
+
+    def __init__(self, interval_sec: float = REFRESH_INTERVAL_SEC, jitter: float = JITTER,
+                 retry_sec: float = RETRY_SEC):
+        self.interval_sec = interval_sec
+        self.jitter = jitter
+        self.retry_sec = retry_sec
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.forced = False
+        self.stopped = False
+        self.checks = 0
+        self.failures = 0
+        self.last_result = None
+        self.last_check_sec = 0.0
+        self.thread = None
+        instrumentation.register_gauge('covid_bot_data_staleness_seconds',
+                                       'Seconds since the source last confirmed the published data',
+                                       virus_utils.get_data_staleness_sec)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='data-refresher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def trigger(self):
+        """Check the source now even if the interval did not pass"""
+        with self.lock:
+            self.forced = True
+        self.wakeup.set()
+
+    def next_delay(self, failed: bool) -> float:
+        delay = min(self.retry_sec, self.interval_sec) if failed else self.interval_sec
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run(self):
+        delay = 0.0  # data older than the interval is checked right at start
+        while True:
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            with self.lock:
+                force, self.forced = self.forced, False
+            delay = self.next_delay(self.refresh(force) is None)
+
+    def refresh(self, force: bool = False) -> Optional[bool]:
+        """Returns True if new data was published, False if there is nothing new, None on failure"""
+        try:
+            result = virus_utils.refresh_data(self.interval_sec, force)
+            if result is True:
+                virus_utils.fetch_dataset()  # map it before the first request needs it
+        except Exception:
+            logger.exception('Data refresh failed')
+            result = None
+
+        instrumentation.REFRESHES.inc({True: 'new', False: 'unchanged', None: 'failed'}[result])
+        with self.lock:
+            self.checks += 1
+            if result is None:
+                self.failures += 1
+            self.last_result = result
+            self.last_check_sec = time.time()
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'interval_sec': self.interval_sec,
+                    'checks': self.checks,
+                    'failures': self.failures,
+                    'last_result': self.last_result,
+                    'last_check': int(self.last_check_sec),
+                    'staleness_sec': virus_utils.get_data_staleness_sec(),
+                    'version': virus_utils.get_data_version()}
@@ -0,0 +1,84 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKER_COUNT = 4  # 0 processes updates inside the webhook request
+QUEUE_SIZE = 100  # updates waiting for a worker, telegram redelivers rejected ones
+
+
+class RenderQueue:
+    """Bounded queue of webhook updates processed by a pool of worker threads"""
+
+    def __init__(self, handler: Callable[[dict], None], workers: int = WORKER_COUNT, max_size: int = QUEUE_SIZE):
+        self.handler = handler
+        self.jobs = queue.Queue(maxsize=max_size)
+        self.workers = workers
+        self.stats_lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_sec_total = 0.0
+        self.run_sec_total = 0.0
+        self.run_sec_max = 0.0
+        self.run_sec_last = 0.0
+        for idx in range(workers):
+            threading.Thread(target=self.work, name=f'render-worker-{idx}', daemon=True).start()
+
+    def submit(self, update: dict) -> bool:
+        """Enqueue an update without waiting, returns False if the queue is full"""
+        try:
+            self.jobs.put_nowait((time.monotonic(), update))
+        except queue.Full:
+            with self.stats_lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def work(self):
+        while True:
+            queued_at, update = self.jobs.get()
+            started_at = time.monotonic()
+            failed = False
+            try:
+                self.handler(update)
+            except Exception:
+                failed = True
+                logger.exception('Update processing failed')
+            finally:
+                self.jobs.task_done()
+            self.record(started_at - queued_at, time.monotonic() - started_at, failed)
+
+    def record(self, wait_sec: float, run_sec: float, failed: bool):
+        with self.stats_lock:
+            self.processed += 1
+            if failed:
+                self.failed += 1
+            self.wait_sec_total += wait_sec
+            self.run_sec_total += run_sec
+            self.run_sec_max = max(self.run_sec_max, run_sec)
+            self.run_sec_last = run_sec
+
+    def depth(self) -> int:
+        return self.jobs.qsize()
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            processed = self.processed
+            return {
+                'workers': self.workers,
+                'depth': self.depth(),
+                'capacity': self.jobs.maxsize,
+                'processed': processed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'avg_wait_sec': self.wait_sec_total / processed if processed else 0.0,
+                'avg_run_sec': self.run_sec_total / processed if processed else 0.0,
+                'max_run_sec': self.run_sec_max,
+                'last_run_sec': self.run_sec_last
+            }
@@ -0,0 +1,56 @@
+import threading
+from typing import Any, Callable, Hashable, Tuple
+
+WAIT_TIMEOUT_SEC = 20  # waiters give up on a render that takes longer
+
+
+class FlightTimeout(Exception):
+    """The caller doing the work did not finish in time"""
+
+
+class Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key run the function once, the other callers wait and share its result"""
+
+    def __init__(self, timeout_sec: float = WAIT_TIMEOUT_SEC):
+        self.timeout_sec = timeout_sec
+        self.lock = threading.Lock()
+        self.flights = {}  # key -> Flight in progress
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns the result and whether it was shared from another caller"""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self.flights[key] = flight
+
+        if leader:
+            try:
+                flight.result = func()
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+            return flight.result, False
+
+        if flight.done.wait(self.timeout_sec) is False:
+            raise FlightTimeout(key)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.flights)
@@ -0,0 +1,118 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+import dataset
+import io_utils
+from models import StatType
+
+WINDOW_SIZE = 7  # rolling average over a week
+
+
+@dataclass(frozen=True)
+class DerivedMetrics:
+    """Series derived from a Dataset for all countries at once, same countries x days (x stat) layout"""
+    version: str
+    daily: np.ndarray  # int64, day over day increase, negative corrections clamped to zero
+    rolling_mean: np.ndarray  # float64, mean of daily values over the last WINDOW_SIZE days
+    per_million: np.ndarray  # float64, rolling_mean per million inhabitants, nan if population unknown
+    fatality_rate: np.ndarray  # float64, countries x days deaths / confirmed, nan before first case
+    population: np.ndarray  # int64, 0 if unknown
+
+
+metrics_lock = threading.Lock()
+metrics_cache = {}  # dataset version -> DerivedMetrics
+
+
+def clamped_diff(values: np.ndarray) -> np.ndarray:
+    """Daily increase of cumulative totals along the days axis, the first day counts from zero"""
+    return np.maximum(np.diff(values, axis=1, prepend=0), 0)
+
+
+def rolling_mean(daily: np.ndarray, window: int = WINDOW_SIZE) -> np.ndarray:
+    """Cumsum based moving average along the days axis, first days are averaged over what is available"""
+    sums = np.cumsum(daily, axis=1, dtype=np.float64)
+    sums[:, window:] -= sums[:, :-window].copy()
+    days = daily.shape[1]
+    counts = np.minimum(np.arange(1, days + 1), window).astype(np.float64)
+    return sums / counts.reshape((1, days) + (1,) * (daily.ndim - 2))
+
+
+def per_million(values: np.ndarray, population: np.ndarray) -> np.ndarray:
+    millions = np.where(population > 0, population / 1_000_000, np.nan)
+    return values / millions.reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+def fatality_rate(values: np.ndarray) -> np.ndarray:
+    """deaths / confirmed of countries x days x stat values"""
+    confirmed = values[:, :, StatType.CONFIRMED]
+    deaths = values[:, :, StatType.DEATHS]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(confirmed > 0, deaths / confirmed, np.nan)
+
+
+def freeze(metrics: DerivedMetrics) -> DerivedMetrics:
+    for arr in (metrics.daily, metrics.rolling_mean, metrics.per_million, metrics.fatality_rate):
+        arr.setflags(write=False)
+    return metrics
+
+
+def compute_metrics(data: dataset.Dataset) -> DerivedMetrics:
+    daily = clamped_diff(data.values)
+    avg = rolling_mean(daily)
+    population = np.array([io_utils.get_population(name) for name in data.countries], dtype=np.int64)
+    return freeze(DerivedMetrics(version=data.version,
+                                 daily=daily,
+                                 rolling_mean=avg,
+                                 per_million=per_million(avg, population),
+                                 fatality_rate=fatality_rate(data.values),
+                                 population=population))
+
+
+def extend_metrics(metrics: DerivedMetrics, data: dataset.Dataset, first_changed: int) -> DerivedMetrics:
+    """Recompute only the days from first_changed on, earlier days of data are the same as in metrics"""
+    # daily values need the day before, the rolling mean needs a whole window before
+    daily_start = max(0, first_changed - 1)
+    daily_tail = clamped_diff(data.values[:, daily_start:])
+    if first_changed > 0:
+        daily_tail = daily_tail[:, 1:]
+    daily = np.concatenate((metrics.daily[:, :first_changed], daily_tail), axis=1)
+
+    window_start = max(0, first_changed - WINDOW_SIZE + 1)
+    avg_tail = rolling_mean(daily[:, window_start:])[:, first_changed - window_start:]
+    avg = np.concatenate((metrics.rolling_mean[:, :first_changed], avg_tail), axis=1)
+
+    return freeze(DerivedMetrics(
+        version=data.version,
+        daily=daily,
+        rolling_mean=avg,
+        per_million=np.concatenate((metrics.per_million[:, :first_changed],
+                                    per_million(avg_tail, metrics.population)), axis=1),
+        fatality_rate=np.concatenate((metrics.fatality_rate[:, :first_changed],
+                                      fatality_rate(data.values[:, first_changed:])), axis=1),
+        population=metrics.population))
+
+
+def update_metrics(previous: dataset.Dataset, data: dataset.Dataset, first_changed: int) -> DerivedMetrics:
+    """Metrics of a dataset merged on top of previous, extends the cached ones instead of a full rebuild"""
+    with metrics_lock:
+        metrics = metrics_cache.get(previous.version)
+        if metrics is None:
+            metrics = compute_metrics(data)
+        else:
+            metrics = extend_metrics(metrics, data, first_changed)
+        metrics_cache.clear()
+        metrics_cache[data.version] = metrics
+        return metrics
+
+
+def get_metrics(data: dataset.Dataset) -> DerivedMetrics:
+    """Derived metrics of the dataset, computed once per data version"""
+    with metrics_lock:
+        metrics = metrics_cache.get(data.version)
+        if metrics is None:
+            metrics = compute_metrics(data)
+            metrics_cache.clear()  # only the latest version is ever requested
+            metrics_cache[data.version] = metrics
+        return metrics
@@ -0,0 +1,80 @@
+"""Synthetic datasets in pomber timeseries format for benchmarks and load tests, no network needed"""
+import datetime
+import json
+import time
+from typing import List
+
+import numpy as np
+
+import dataset
+import io_utils
+import virus_utils
+from models import Countries
+
+FIRST_DATE = datetime.date(2020, 1, 22)  # first day of the pomber timeseries
+
+
+def country_names(country_count: int) -> List[str]:
+    """Names known by the bot first so country charts have data, then made up ones"""
+    names = list(dict.fromkeys(member.serverId for member in Countries))[:country_count]
+    names += [f'Country {idx:03d}' for idx in range(len(names), country_count)]
+    return names
+
+
+def cumulative_series(rng: np.random.RandomState, day_count: int, scale: float) -> np.ndarray:
+    """Cumulative totals of a wave that starts on a random day"""
+    start = rng.randint(0, max(1, day_count // 3))
+    days = np.arange(day_count) - start
+    rate = scale * np.exp(-((days - day_count / 2) / (day_count / 4)) ** 2)  # one smooth wave
+    daily = rng.poisson(np.where(days >= 0, rate, 0))
+    return np.cumsum(daily)
+
+
+def generate_timeseries(country_count: int = 200, day_count: int = 120, seed: int = 0) -> dict:
+    """{country: [{date, confirmed, deaths, recovered}]} like https://pomber.github.io/covid19/timeseries.json"""
+    rng = np.random.RandomState(seed)
+    dates = [dataset.format_pomber_date(FIRST_DATE + datetime.timedelta(days=idx)) for idx in range(day_count)]
+
+    json_data = {}
+    for name in country_names(country_count):
+        confirmed = cumulative_series(rng, day_count, scale=rng.uniform(10, 5000))
+        deaths = (confirmed * rng.uniform(0.01, 0.08)).astype(np.int64)
+        lag = rng.randint(7, 21)  # recovered follow confirmed cases after a couple of weeks
+        recovered = np.concatenate((np.zeros(lag, dtype=np.int64), confirmed[:-lag] * 0.9))[:day_count]
+        json_data[name] = [{'date': date,
+                            'confirmed': int(confirmed[idx]),
+                            'deaths': int(deaths[idx]),
+                            'recovered': int(recovered[idx])} for idx, date in enumerate(dates)]
+    return json_data
+
+
+def write_timeseries(path: str, country_count: int = 200, day_count: int = 120, seed: int = 0):
+    with open(path, 'w') as outfile:
+        json.dump(generate_timeseries(country_count, day_count, seed), outfile)
+
+
+def install_timeseries(work_dir: str, country_count: int = 200, day_count: int = 120, seed: int = 0):
+    """Point all bot paths to work_dir and store a fresh synthetic dataset there, nothing is downloaded later"""
+    io_utils.dir_path = f'{work_dir}/'
+    json_data = generate_timeseries(country_count, day_count, seed)
+    virus_utils.import_timeseries(json.dumps(json_data).encode('utf-8'))
+    now = int(time.time())
+    io_utils.write_pref_values({'checked': now, 'datetime': str(now)})
+
+
+def text_update(text: str, update_id: int = 1, chat_id: int = 1) -> dict:
+    """Webhook update of a private chat message, the user id is the chat id"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Synthetic'}
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                        'from': user, 'chat': {'id': chat_id, 'type': 'private'}}}
+
+
+def callback_update(data: str, update_id: int = 1, chat_id: int = 1) -> dict:
+    """Webhook update of a pressed inline button, e.g. a country from the /country keyboard"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Synthetic'}
+    message = {'message_id': update_id, 'date': int(time.time()), 'text': 'Select your country',
+               'chat': {'id': chat_id, 'type': 'private'}}
+    return {'update_id': update_id,
+            'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': str(chat_id),
+                               'data': data, 'message': message}}
@@ -0,0 +1,118 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import virus_utils
+from models import StatType
+
+HEADER = 'Province/State,Country/Region,Lat,Long'
+
+CONFIRMED = f"""{HEADER},1/22/20,1/23/20,1/24/20
+New South Wales,Australia,-33.8,151.2,1,3,4
+Victoria,Australia,-37.8,144.9,2,2,6
+,Italy,41.8,12.5,10,20,30
+"""
+
+DEATHS = f"""{HEADER},1/22/20,1/23/20,1/24/20
+New South Wales,Australia,-33.8,151.2,0,1,1
+Victoria,Australia,-37.8,144.9,0,0,2
+,Italy,41.8,12.5,1,2,3
+"""
+
+RECOVERED_SHORT = f"""{HEADER},1/22/20,1/23/20
+,Australia,-25.0,133.0,0,1
+,Italy,41.8,12.5,0,5
+"""
+
+
+class CsseServer:
+    """Serves files of the CSSE time series folder from memory, a file can answer with an error status"""
+
+    def __init__(self):
+        self.files = {}  # file name -> (status, body)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, body = server.files.get(self.path.rsplit('/', 1)[-1], (404, 'Not Found'))
+                payload = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('localhost', 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/csse_covid_19_time_series'
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class CsseLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = CsseServer()
+        self.base_url = virus_utils.csse_base_url
+        self.retries = virus_utils.HTTP_RETRIES
+        virus_utils.csse_base_url = self.server.base_url
+        virus_utils.HTTP_RETRIES = 1  # a 5xx is retried once, keeps the test fast
+        virus_utils.http_session = None
+
+    def tearDown(self):
+        virus_utils.csse_base_url = self.base_url
+        virus_utils.HTTP_RETRIES = self.retries
+        virus_utils.http_session = None
+        self.server.stop()
+
+    def serve(self, confirmed: str = CONFIRMED, deaths: str = DEATHS, recovered: str = CONFIRMED):
+        files = virus_utils.CSSE_GLOBAL_FILES
+        self.server.files[files[StatType.CONFIRMED]] = (200, confirmed)
+        self.server.files[files[StatType.DEATHS]] = (200, deaths)
+        self.server.files[files[StatType.RECOVERED]] = (200, recovered)
+
+    def test_provinces_are_summed_into_countries(self):
+        self.serve()
+        data = virus_utils.fetch_csse_dataset()
+
+        self.assertEqual(data.countries, ['Australia', 'Italy'])
+        australia = data.row('Australia')
+        np.testing.assert_array_equal(data.series(australia, StatType.CONFIRMED), [3, 5, 10])
+        np.testing.assert_array_equal(data.series(australia, StatType.DEATHS), [0, 1, 3])
+        np.testing.assert_array_equal(data.series(data.row('Italy'), StatType.CONFIRMED), [10, 20, 30])
+
+    def test_days_missing_in_a_series_are_dropped(self):
+        self.serve(recovered=RECOVERED_SHORT)
+        data = virus_utils.fetch_csse_dataset()
+
+        np.testing.assert_array_equal(data.dates, np.array(['2020-01-22', '2020-01-23'], dtype='datetime64[D]'))
+        italy = data.row('Italy')
+        np.testing.assert_array_equal(data.series(italy, StatType.CONFIRMED), [10, 20])
+        np.testing.assert_array_equal(data.series(italy, StatType.RECOVERED), [0, 5])
+        np.testing.assert_array_equal(data.series(data.row('Australia'), StatType.RECOVERED), [0, 1])
+
+    def test_missing_file_gives_no_dataset(self):
+        self.serve()
+        del self.server.files[virus_utils.CSSE_GLOBAL_FILES[StatType.DEATHS]]
+        self.assertIsNone(virus_utils.fetch_csse_dataset())
+
+    def test_server_error_gives_no_dataset(self):
+        self.serve()
+        self.server.files[virus_utils.CSSE_GLOBAL_FILES[StatType.RECOVERED]] = (503, 'Service Unavailable')
+        self.assertIsNone(virus_utils.fetch_csse_dataset())
+
+
+if __name__ == '__main__':
+    unittest.main()
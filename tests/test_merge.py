@@ -0,0 +1,94 @@
+import copy
+import unittest
+
+import numpy as np
+
+import dataset
+import stats_engine
+import synthetic_data
+
+DAY_COUNT = 40
+NEW_DAYS = 3
+
+
+def truncate(json_data: dict, day_count: int) -> dict:
+    return {name: entries[:day_count] for name, entries in json_data.items()}
+
+
+def revise(json_data: dict, day: int, value: int = 7) -> dict:
+    revised = copy.deepcopy(json_data)
+    for entries in revised.values():
+        entries[day]['confirmed'] += value
+    return revised
+
+
+class MergeDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.json_data = synthetic_data.generate_timeseries(country_count=12, day_count=DAY_COUNT + NEW_DAYS)
+        self.current = dataset.build_dataset(truncate(self.json_data, DAY_COUNT), 'current')
+
+    def assert_same_dataset(self, merged: dataset.Dataset, expected: dataset.Dataset):
+        self.assertEqual(merged.countries, expected.countries)
+        np.testing.assert_array_equal(merged.dates, expected.dates)
+        np.testing.assert_array_equal(merged.values, expected.values)
+
+    def test_new_days_equal_full_rebuild(self):
+        merged, first_changed = dataset.merge_dataset(self.current, self.json_data, 'next')
+        self.assert_same_dataset(merged, dataset.build_dataset(self.json_data))
+        self.assertEqual(merged.version, 'next')
+        self.assertEqual(first_changed, DAY_COUNT)
+
+    def test_recent_revision_equals_full_rebuild(self):
+        day = DAY_COUNT - 3
+        json_data = revise(self.json_data, day)
+        merged, first_changed = dataset.merge_dataset(self.current, json_data, 'next')
+        self.assert_same_dataset(merged, dataset.build_dataset(json_data))
+        self.assertEqual(first_changed, day)
+
+    def test_nothing_new(self):
+        merged, first_changed = dataset.merge_dataset(self.current, truncate(self.json_data, DAY_COUNT), 'same')
+        self.assert_same_dataset(merged, self.current)
+        self.assertEqual(first_changed, DAY_COUNT)
+
+    def test_revision_of_older_days_needs_a_rebuild(self):
+        json_data = revise(self.json_data, DAY_COUNT - dataset.REVISION_DAYS - 5)
+        self.assertIsNone(dataset.merge_dataset(self.current, json_data, 'next'))
+
+    def test_changed_countries_need_a_rebuild(self):
+        json_data = dict(self.json_data)
+        json_data.pop(next(iter(json_data)))
+        self.assertIsNone(dataset.merge_dataset(self.current, json_data, 'next'))
+
+
+class ExtendMetricsTest(unittest.TestCase):
+
+    def assert_same_metrics(self, extended: stats_engine.DerivedMetrics, expected: stats_engine.DerivedMetrics):
+        np.testing.assert_array_equal(extended.daily, expected.daily)
+        np.testing.assert_allclose(extended.rolling_mean, expected.rolling_mean)
+        np.testing.assert_allclose(extended.per_million, expected.per_million)
+        np.testing.assert_allclose(extended.fatality_rate, expected.fatality_rate)
+        np.testing.assert_array_equal(extended.population, expected.population)
+
+    def test_extend_equals_recompute(self):
+        json_data = synthetic_data.generate_timeseries(country_count=12, day_count=DAY_COUNT + NEW_DAYS)
+        current = dataset.build_dataset(truncate(json_data, DAY_COUNT), 'current')
+        metrics = stats_engine.compute_metrics(current)
+        for day in (0, 1, DAY_COUNT - 3, DAY_COUNT):
+            with self.subTest(first_changed=day):
+                # old revisions are rebuilt instead of merged, extend_metrics only needs the days before day unchanged
+                data = dataset.build_dataset(revise(json_data, day), 'next')
+                self.assert_same_metrics(stats_engine.extend_metrics(metrics, data, day),
+                                         stats_engine.compute_metrics(data))
+
+    def test_update_after_merge_equals_recompute(self):
+        json_data = synthetic_data.generate_timeseries(country_count=12, day_count=DAY_COUNT + NEW_DAYS)
+        current = dataset.build_dataset(truncate(json_data, DAY_COUNT), 'current')
+        stats_engine.get_metrics(current)
+        merged, first_changed = dataset.merge_dataset(current, revise(json_data, DAY_COUNT - 2), 'next')
+        self.assert_same_metrics(stats_engine.update_metrics(current, merged, first_changed),
+                                 stats_engine.compute_metrics(merged))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import prefs_store
+
+
+class PrefStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.work_dir.name, 'prefs.db')
+        self.flush_interval_sec = prefs_store.FLUSH_INTERVAL_SEC
+        prefs_store.FLUSH_INTERVAL_SEC = 60  # flushes in the tests are explicit unless a test lowers it
+        self.store = prefs_store.PrefStore(self.path)
+
+    def tearDown(self):
+        prefs_store.FLUSH_INTERVAL_SEC = self.flush_interval_sec
+        self.store.flush()
+        self.work_dir.cleanup()
+
+    def committed(self) -> dict:
+        with sqlite3.connect(self.path) as conn:
+            return dict(conn.execute('SELECT user_id, country FROM pref_country').fetchall())
+
+    def test_writes_are_batched(self):
+        self.store.put(1, 'Italy')
+        self.store.put(2, 'Spain')
+        self.assertEqual(self.committed(), {})
+        self.assertEqual(self.store.get(1), 'Italy')  # pending writes are visible in this process
+
+        self.store.flush()
+        self.assertEqual(self.committed(), {1: 'Italy', 2: 'Spain'})
+
+    def test_full_batch_is_committed_at_once(self):
+        for user_id in range(prefs_store.FLUSH_SIZE):
+            self.store.put(user_id, 'Germany')
+        self.assertEqual(len(self.committed()), prefs_store.FLUSH_SIZE)
+
+    def test_batch_is_committed_after_the_interval(self):
+        prefs_store.FLUSH_INTERVAL_SEC = 0.05
+        self.store.put(1, 'France')
+        deadline = time.time() + 5
+        while not self.committed() and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.committed(), {1: 'France'})
+
+    def test_last_write_of_a_batch_wins(self):
+        self.store.put(1, 'Italy')
+        self.store.put(1, 'Spain')
+        self.store.flush()
+        self.assertEqual(self.committed(), {1: 'Spain'})
+
+    def test_commits_of_other_processes_are_seen(self):
+        self.assertIsNone(self.store.get(1))  # cached as not set
+        other = prefs_store.PrefStore(self.path)
+        other.put(1, 'Japan')
+        other.flush()
+        self.assertEqual(self.store.get(1), 'Japan')
+
+
+if __name__ == '__main__':
+    unittest.main()
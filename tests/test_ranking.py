@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+import ranking
+
+
+class TopKTest(unittest.TestCase):
+
+    def test_highest_scores_first(self):
+        scores = np.array([5, 9, 1, 7])
+        self.assertEqual(ranking.top_k(scores, 3).tolist(), [1, 3, 0])
+
+    def test_ties_keep_row_order(self):
+        scores = np.array([3, 8, 3, 8, 3, 1])
+        self.assertEqual(ranking.top_k(scores, 4).tolist(), [1, 3, 0, 2])
+
+    def test_ties_at_the_cut_keep_row_order(self):
+        scores = np.array([2, 5, 2, 2, 9])
+        self.assertEqual(ranking.top_k(scores, 3).tolist(), [4, 1, 0])
+
+    def test_invalid_rows_are_skipped(self):
+        scores = np.array([np.nan, 4.0, 6.0, np.nan, 5.0])
+        self.assertEqual(ranking.top_k(scores, 5, ~np.isnan(scores)).tolist(), [2, 4, 1])
+
+    def test_same_order_as_a_stable_sort(self):
+        rng = np.random.RandomState(0)
+        scores = rng.randint(0, 10, size=200)
+        expected = sorted(range(len(scores)), key=lambda row: -scores[row])[:25]
+        self.assertEqual(ranking.top_k(scores, 25).tolist(), expected)
+
+    def test_nothing_to_rank(self):
+        self.assertEqual(ranking.top_k(np.array([1, 2]), 0).tolist(), [])
+        self.assertEqual(ranking.top_k(np.array([]), 3).tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import single_flight
+
+CALLERS = 4
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_concurrently(self, flights: single_flight.SingleFlight, key, func) -> list:
+        """CALLERS calls of the same key started together, results or raised errors"""
+        barrier = threading.Barrier(CALLERS)
+
+        def call():
+            barrier.wait()
+            return flights.do(key, func)
+
+        with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+            futures = [executor.submit(call) for _ in range(CALLERS)]
+            return [future.exception() or future.result() for future in futures]
+
+    def test_concurrent_calls_share_one_run(self):
+        flights = single_flight.SingleFlight()
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.2)  # long enough for the other callers to join the flight
+            return 'chart'
+
+        results = self.run_concurrently(flights, 'key', render)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * (CALLERS - 1))
+        self.assertTrue(all(result == 'chart' for result, _ in results))
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_error_is_raised_to_every_caller(self):
+        flights = single_flight.SingleFlight()
+
+        def fail():
+            time.sleep(0.2)
+            raise ValueError('render failed')
+
+        results = self.run_concurrently(flights, 'key', fail)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_different_keys_run_separately(self):
+        flights = single_flight.SingleFlight()
+        self.assertEqual(flights.do('a', lambda: 1), (1, False))
+        self.assertEqual(flights.do('b', lambda: 2), (2, False))
+
+    def test_waiter_gives_up_after_the_timeout(self):
+        flights = single_flight.SingleFlight(timeout_sec=0.05)
+        release = threading.Event()
+        leader = threading.Thread(target=flights.do, args=('key', lambda: release.wait(5)))
+        leader.start()
+        while flights.in_flight() == 0:
+            time.sleep(0.01)
+        with self.assertRaises(single_flight.FlightTimeout):
+            flights.do('key', lambda: None)
+        release.set()
+        leader.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from dataclasses import replace
+
+import numpy as np
+
+import dataset
+import synthetic_data
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.work_dir.name, 'timeseries.bin')
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def round_trip(self, data: dataset.Dataset) -> dataset.Dataset:
+        with open(self.path, 'wb') as fp:
+            dataset.write_snapshot(fp, data)
+        return dataset.load_snapshot(self.path, 'v1', 1600000000, 'Sep 13 2020')
+
+    def test_snapshot_round_trips(self):
+        data = dataset.build_dataset(synthetic_data.generate_timeseries(country_count=15, day_count=30))
+        loaded = self.round_trip(data)
+
+        self.assertEqual(loaded.countries, data.countries)
+        self.assertEqual(loaded.country_index, data.country_index)
+        np.testing.assert_array_equal(loaded.dates, data.dates)
+        np.testing.assert_array_equal(loaded.values, data.values)
+        self.assertEqual((loaded.version, loaded.updated, loaded.updated_label), ('v1', 1600000000, 'Sep 13 2020'))
+
+    def test_loaded_arrays_are_read_only(self):
+        loaded = self.round_trip(dataset.build_dataset(synthetic_data.generate_timeseries(3, 5)))
+        self.assertFalse(loaded.values.flags.writeable)
+        self.assertFalse(loaded.dates.flags.writeable)
+
+    def test_unicode_names_round_trip(self):
+        json_data = synthetic_data.generate_timeseries(country_count=2, day_count=4)
+        json_data = dict(zip(["Côte d'Ivoire", 'Curaçao'], json_data.values()))
+        self.assertEqual(self.round_trip(dataset.build_dataset(json_data)).countries, ["Côte d'Ivoire", 'Curaçao'])
+
+    def test_empty_dataset_round_trips(self):
+        loaded = self.round_trip(dataset.build_dataset({}))
+        self.assertEqual(loaded.countries, [])
+        self.assertEqual(loaded.values.shape, (0, 0, dataset.STAT_COUNT))
+
+    def test_values_beyond_int32_are_refused(self):
+        data = dataset.build_dataset(synthetic_data.generate_timeseries(country_count=1, day_count=2))
+        values = data.values.copy()
+        values[0, 1, 0] = 2 ** 31
+        with open(self.path, 'wb') as fp, self.assertRaises(ValueError):
+            dataset.write_snapshot(fp, replace(data, values=values))
+
+    def test_other_files_are_refused(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(b'{"Italy": []}' + bytes(32))
+        with self.assertRaises(ValueError):
+            dataset.load_snapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,30 +2,128 @@
 """Main module"""
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Tuple, Union, TYPE_CHECKING
 
 import telegram
 from bottle import Bottle, response, request as bottle_request
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest
+from telegram.utils.request import Request
 
+import file_id_cache
+import image_cache
+import instrumentation
 import io_utils
-import plot_utils
+import render_queue
+import single_flight
 import tg_utils
 import virus_utils
 from models import Countries, Country, GraphType, StatType
 
+if TYPE_CHECKING:
+    import dataset  # numpy is imported by the first chart, not at startup
+
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+BOT_WELCOME = """
+                     Welcome to COVID-19 Visual bot. I visualize statistics related to COVID-19.
+
+                     Send command /stats to get statistics for whole world or country.
+                     Send command /country to select your country
+                     """
+
+DATA_LOADING = 'Statistics are being loaded, please try again in a minute'
+
+# world charts in menu keyboard order: command, button label, stat, chart
+WORLD_COMMANDS = [
+    ('/cases_week', '\u200e🌏 Cases AVG', StatType.CONFIRMED, GraphType.CONFIRMED_WEEK),
+    ('/fatal_week', '\u200e🌏 Fatal AVG', StatType.DEATHS, GraphType.DEATHS_WEEK),
+    ('/fatal_rate', '\u200e🌏 Fatal Rate', StatType.DEATHS, GraphType.DEATHS_RATE),
+    ('/cases_per_1m', '\u200e🌏 Cases per 1M', StatType.CONFIRMED, GraphType.CONFIRMED_1M_PEOPLE),
+    ('/cases', '\u200e🌏 Cases', StatType.CONFIRMED, GraphType.CONFIRMED_TOTAL),
+    ('/fatal', '\u200e🌏 Fatal', StatType.DEATHS, GraphType.DEATHS_TOTAL),
+    ('/cases_bar', '\u200e🌏 Cases (bar)', StatType.CONFIRMED, GraphType.CONFIRMED_BAR),
+    ('/fatal_bar', '\u200e🌏 Fatal (bar)', StatType.DEATHS, GraphType.DEATHS_BAR)
+]
+
+# country charts in menu keyboard order: command suffix, button label after the flag, active, stat, chart
+COUNTRY_COMMANDS = [
+    ('cases_total', 'Total Cases', False, StatType.CONFIRMED, GraphType.CONFIRMED_TOTAL),
+    ('fatal_total', 'Total Fatal', False, StatType.DEATHS, GraphType.DEATHS_TOTAL),
+    ('cases_daily', 'Daily Cases', True, StatType.CONFIRMED, GraphType.CONFIRMED_ACTIVE),
+    ('fatal_daily', 'Daily Fatal', True, StatType.DEATHS, GraphType.DEATHS_ACTIVE)
+]
+# all country charts above in one album: command suffix, button label after the flag
+COUNTRY_ALBUM_COMMAND = ('all', 'All charts')
+
+BUTTONS_PER_ROW = 4
+
+
+def build_country_select_keyboard() -> InlineKeyboardMarkup:
+    temp_list = []
+    keyboard = []
+
+    items = Countries.__members__.items()
+    length = len(items)
+    if length % 4 == 0:
+        rows_per_item = 4
+    else:
+        rows_per_item = 3
+    idx = 0
+    for name, member in items:
+        str_val = member.displayString
+        int_val = member.displayValue
+
+        if idx > 0 and idx % rows_per_item == 0:  # 4 4 3 3
+            keyboard.append(temp_list)  # construct lines
+            temp_list = []
+        temp_list.append(InlineKeyboardButton(str_val, callback_data=int_val))
+        idx = idx + 1
+    keyboard.append(temp_list)
+    return InlineKeyboardMarkup(keyboard)
+
+
+def build_menu_keyboard(country: Countries) -> ReplyKeyboardMarkup:
+    labels = [label for _, label, _, _ in WORLD_COMMANDS]
+    labels += [f'{country.displayFlag} {label}' for _, label, _, _, _ in COUNTRY_COMMANDS]
+    labels.append(f'{country.displayFlag} {COUNTRY_ALBUM_COMMAND[1]}')
+    keyboard = [[KeyboardButton(text=label) for label in labels[idx:idx + BUTTONS_PER_ROW]]
+                for idx in range(0, len(labels), BUTTONS_PER_ROW)]
+    return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=keyboard, one_time_keyboard=False)
+
+
 class TelegramBot:
 
     def error(update, context):
         """Log Errors caused by Updates."""
         logger.warning('Update "%s" caused error "%s"', update, context.error)
 
-    def __init__(self, token: str):
-        self.tgBOT = telegram.Bot(token=token)
+    def __init__(self, token: str, workers: int = render_queue.WORKER_COUNT, base_url: str = None,
+                 image_cache_bytes: int = image_cache.MAX_BYTES):
+        # every render worker may call the api at the same time, the default pool keeps a single connection
+        request = Request(con_pool_size=workers + 1)
+        self.tgBOT = telegram.Bot(token=token, base_url=base_url, request=request)  # base_url None is telegram
+        self.render_queue = render_queue.RenderQueue(self.process_update, workers) if workers > 0 else None
+        if self.render_queue is not None:
+            instrumentation.register_gauge('covid_bot_render_queue_depth', 'Updates waiting for a render worker',
+                                           self.render_queue.depth)
+        # keyboards and commands do not change while running, build them once
+        self.country_select_keyboard = build_country_select_keyboard()
+        self.menu_keyboards = {member: build_menu_keyboard(member) for member in Countries}
+        self.commands = self.build_commands()
+        self.render_flights = single_flight.SingleFlight()
+        self.image_cache = image_cache.ImageCache(image_cache_bytes)
+        instrumentation.register_gauge('covid_bot_image_cache_bytes', 'Size of encoded charts kept in memory',
+                                       lambda: self.image_cache.size)
+        instrumentation.register_gauge('covid_bot_image_cache_hit_ratio', 'Share of image lookups found in memory',
+                                       self.image_cache.hit_rate)
+        # album charts use different templates, they render at the same time
+        self.album_executor = ThreadPoolExecutor(max_workers=len(COUNTRY_COMMANDS), thread_name_prefix='album')
 
     def run(self, bottle: Bottle):
         bottle.route('/api', callback=self.post_handler, method="POST")
@@ -37,132 +135,94 @@ class TelegramBot:
         self.tgBOT.sendMessage(chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id)
 
     def prompt_select_new_country(self, chat_id: int):
-        temp_list = []
-        keyboard = []
-
-        items = Countries.__members__.items()
-        length = len(items)
-        if length % 4 == 0:
-            rows_per_item = 4
-        else:
-            rows_per_item = 3
-        idx = 0
-        for name, member in items:
-            str_val = member.displayString
-            int_val = member.displayValue
-
-            if idx > 0 and idx % rows_per_item == 0:  # 4 4 3 3
-                keyboard.append(temp_list)  # construct lines
-                temp_list = []
-            temp_list.append(InlineKeyboardButton(str_val, callback_data=int_val))
-            idx = idx + 1
-        keyboard.append(temp_list)
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
         self.tgBOT.sendMessage(chat_id=chat_id,
                                text="Select your country",
-                               reply_markup=reply_markup)
+                               reply_markup=self.country_select_keyboard)
 
-    def react_stats_option(self, text: str, chat_id: int, user_id: int) -> bool:
-        # for debugging purposes only
-        if io_utils.is_local_run():
-            print("got text message :", text)
-        # the first time you chat with the bot AKA the welcoming message
-        if text == "/start" or text == "/help":
-            bot_welcome = """
-                     Welcome to COVID-19 Visual bot. I visualize statistics related to COVID-19.
+    def build_commands(self) -> dict:
+        """Maps every slash command and keyboard button text to a handler taking chat_id and user_id"""
+        commands = {}
 
-                     Send command /stats to get statistics for whole world or country.
-                     Send command /country to select your country
-                     """
-            self.tgBOT.sendMessage(chat_id=chat_id, text=bot_welcome)
-            return True
+        def add(handler, *texts):
+            for text in texts:
+                commands.setdefault(text, handler)  # first registered wins, some countries share a flag
 
-        if text == '/country':
-            self.prompt_select_new_country(chat_id)
-            return True
+        add(self.on_welcome, '/start', '/help')
+        add(self.on_country, '/country')
+        add(self.on_stats, '/stats')
+        add(self.on_test, '/test')
 
-        if text == '/stats':
-            country = virus_utils.read_pref_country(user_id=user_id)
-            self.buildMenuSendMessage(chat_id, country)
-            return True
+        for command, label, stat_type, graph_type in WORLD_COMMANDS:
+            add(partial(self.on_world_chart, stat_type, graph_type), command, label)
 
-        if text == '/test':
-            self.tgBOT.sendMessage(chat_id=chat_id,
-                                   text="There was a problem in the name you used, please enter different name")
-            return True
+        for member in Countries:
+            for suffix, label, active, stat_type, graph_type in COUNTRY_COMMANDS:
+                handler = partial(self.on_country_chart, active, stat_type, graph_type, member.value)
+                add(handler, f'/{member.displayValue}_{suffix}', f'{member.displayFlag} {label}')
+            suffix, label = COUNTRY_ALBUM_COMMAND
+            add(partial(self.on_country_album, member.value), f'/{member.displayValue}_{suffix}',
+                f'{member.displayFlag} {label}')
+        return commands
 
-        if text == '/cases_week' or text == '‎🌏 Cases AVG':
-            self.send_photo_tg_general(stat_type=StatType.CONFIRMED, chat_id=chat_id,
-                                       graph_type=GraphType.CONFIRMED_WEEK)
-            return True
+    def on_welcome(self, chat_id: int, user_id: int):
+        self.tgBOT.sendMessage(chat_id=chat_id, text=BOT_WELCOME)
 
-        if text == '/fatal_week' or text == '‎🌏 Fatal AVG':
-            self.send_photo_tg_general(stat_type=StatType.DEATHS, chat_id=chat_id,
-                                       graph_type=GraphType.DEATHS_WEEK)
-            return True
+    def on_country(self, chat_id: int, user_id: int):
+        self.prompt_select_new_country(chat_id)
 
-        if text == '/fatal_rate' or text == '‎🌏 Fatal Rate':
-            self.send_photo_tg_general(stat_type=StatType.DEATHS, chat_id=chat_id,
-                                       graph_type=GraphType.DEATHS_RATE)
-            return True
+    def on_stats(self, chat_id: int, user_id: int):
+        country = virus_utils.read_pref_country(user_id=user_id)
+        self.buildMenuSendMessage(chat_id, country)
 
-        if text == '/cases_per_1m' or text == '‎🌏 Cases per 1M':
-            self.send_photo_tg_general(stat_type=StatType.CONFIRMED, chat_id=chat_id,
-                                       graph_type=GraphType.CONFIRMED_1M_PEOPLE)
-            return True
+    def on_test(self, chat_id: int, user_id: int):
+        self.tgBOT.sendMessage(chat_id=chat_id,
+                               text="There was a problem in the name you used, please enter different name")
 
-        if text == '/cases_bar' or text == '‎🌏 Cases (bar)':
-            self.send_photo_tg_general(stat_type=StatType.CONFIRMED, chat_id=chat_id,
-                                       graph_type=GraphType.CONFIRMED_BAR)
-            return True
+    def on_world_chart(self, stat_type: StatType, graph_type: GraphType, chat_id: int, user_id: int):
+        self.send_photo_tg_general(stat_type=stat_type, chat_id=chat_id, graph_type=graph_type)
 
-        if text == '/fatal_bar' or text == '‎🌏 Fatal (bar)':
-            self.send_photo_tg_general(stat_type=StatType.DEATHS, chat_id=chat_id,
-                                       graph_type=GraphType.DEATHS_BAR)
-            return True
+    def on_country_chart(self, active: bool, stat_type: StatType, graph_type: GraphType, country: Country,
+                         chat_id: int, user_id: int):
+        self.send_photo_tg_country(active, stat_type, country, chat_id, graph_type)
 
-        if text == '/cases' or text == '‎🌏 Cases':
-            self.send_photo_tg_general(stat_type=StatType.CONFIRMED, chat_id=chat_id,
-                                       graph_type=GraphType.CONFIRMED_TOTAL)
-            return True
+    def on_country_album(self, country: Country, chat_id: int, user_id: int):
+        self.send_photo_tg_country_album(country, chat_id)
 
-        if text == '/fatal' or text == '‎🌏 Fatal':
-            self.send_photo_tg_general(stat_type=StatType.DEATHS, chat_id=chat_id,
-                                       graph_type=GraphType.DEATHS_TOTAL)
-            return True
+    def react_stats_option(self, text: str, chat_id: int, user_id: int) -> bool:
+        # for debugging purposes only
+        if io_utils.is_local_run():
+            print("got text message :", text)
 
-        for name, member in Countries.__members__.items():
-            int_val = member.displayValue
-            flag = member.displayFlag
-            country_value = member.value
-
-            if text == f'/{int_val}_fatal_total' or text == f"{flag} Total Fatal":
-                self.send_photo_tg_country_total(stat_type=plot_utils.StatType.DEATHS, chat_id=chat_id,
-                                                 graph_type=GraphType.DEATHS_TOTAL,
-                                                 country_name=country_value)
-                return True
-
-            if text == f'/{int_val}_cases_total' or text == f"{flag} Total Cases":
-                self.send_photo_tg_country_total(stat_type=StatType.CONFIRMED, chat_id=chat_id,
-                                                 graph_type=GraphType.CONFIRMED_TOTAL,
-                                                 country_name=country_value)
-                return True
-
-            if text == f'/{int_val}_fatal_daily' or text == f"{flag} Daily Fatal":
-                self.send_photo_tg_country_active(stat_type=StatType.DEATHS, chat_id=chat_id,
-                                                  graph_type=GraphType.DEATHS_ACTIVE,
-                                                  country_name=country_value)
-                return True
-
-            if text == f'/{int_val}_cases_daily' or text == f"{flag} Daily Cases":
-                self.send_photo_tg_country_active(stat_type=StatType.CONFIRMED, chat_id=chat_id,
-                                                  graph_type=GraphType.CONFIRMED_ACTIVE,
-                                                  country_name=country_value)
-                return True
+        handler = self.commands.get(text)
+        if handler is None:
+            return False
+        handler(chat_id=chat_id, user_id=user_id)
+        return True
 
+    @instrumentation.timed('webhook')
     def post_handler(self):
+        """Acknowledge the webhook at once, updates are processed by render workers"""
         data = bottle_request.json
+        if data is None:
+            instrumentation.UPDATES.inc('invalid')
+            response.status = 400
+            return
+
+        if self.render_queue is None:
+            instrumentation.UPDATES.inc('processed')
+            self.process_update(data)
+        elif self.render_queue.submit(data) is False:
+            instrumentation.UPDATES.inc('rejected')
+            print('Render queue is full')
+            response.status = 503  # telegram delivers the update again later
+        else:
+            instrumentation.UPDATES.inc('queued')
+
+    def process_update(self, data: dict):
+        with instrumentation.request_scope():
+            self.handle_update(data)
+
+    def handle_update(self, data: dict):
         update = telegram.Update.de_json(data, self.tgBOT)
         query = update.callback_query
 
@@ -208,53 +268,123 @@ class TelegramBot:
             return
 
         self.send_message(text='No option selected', chat_id=chat_id)
-        return response
-
-    def buildMenuSendMessage(self, chat_id: int, country: Country):
-        self.tgBOT.sendMessage(chat_id, 'Select keyboard option',
-                               reply_markup=ReplyKeyboardMarkup(
-                                   resize_keyboard=True,
-                                   keyboard=[
-                                       [
-                                           KeyboardButton(text="‎🌏 Cases AVG"),
-                                           KeyboardButton(text="‎🌏 Fatal AVG"),
-                                           KeyboardButton(text="‎🌏 Fatal Rate"),
-                                           KeyboardButton(text="‎🌏 Cases per 1M")
-                                       ],
-                                       [
-                                           KeyboardButton(text="‎🌏 Cases"),
-                                           KeyboardButton(text="‎🌏 Fatal"),
-                                           KeyboardButton(text="‎🌏 Cases (bar)"),
-                                           KeyboardButton(text="‎🌏 Fatal (bar)")
-                                       ],
-                                       [
-                                           KeyboardButton(text=f"{country.displayFlag} Total Cases"),
-                                           KeyboardButton(text=f"{country.displayFlag} Total Fatal"),
-                                           KeyboardButton(text=f"{country.displayFlag} Daily Cases"),
-                                           KeyboardButton(text=f"{country.displayFlag} Daily Fatal")
-                                       ]
-                                   ],
-                                   one_time_keyboard=False
-                               ))
+
+    def buildMenuSendMessage(self, chat_id: int, country: Countries):
+        reply_markup = self.menu_keyboards.get(country)
+        if reply_markup is None:
+            reply_markup = build_menu_keyboard(country)
+        self.tgBOT.sendMessage(chat_id, 'Select keyboard option', reply_markup=reply_markup)
+
+    def send_photo_cached(self, chat_id: int, graph_type: GraphType, country: Country = None) -> bool:
+        """
+        Send the chart of the published data version by telegram file_id, from memory or from disk,
+        returns False if it has to be rendered
+        """
+        version = virus_utils.get_data_version()
+        if version is None:
+            return False
+        sent = tg_utils.send_photo_file_id(self.tgBOT, chat_id, graph_type, country, version)
+        instrumentation.count_cache('file_id', sent)
+        if sent:
+            return True
+
+        photo = self.read_photo(graph_type, country, version)
+        if photo is None:
+            return False
+        tg_utils.send_photo_bytes(self.tgBOT, photo, chat_id, graph_type, country, version)
+        return True
+
+    def read_photo(self, graph_type: GraphType, country: Optional[Country], version: str) -> Optional[bytes]:
+        """Encoded chart of the data version from memory or from disk"""
+        key = (graph_type, country, version)
+        photo = self.image_cache.get(key)
+        instrumentation.count_cache('memory', photo is not None)
+        if photo is None:
+            photo_url = io_utils.get_photo_path_url(graph_type=graph_type, country=country, version=version)
+            exists = os.path.exists(photo_url)
+            instrumentation.count_cache('disk', exists)
+            if exists is False:
+                return None
+            with open(photo_url, 'rb') as photo_stream:
+                photo = photo_stream.read()
+            self.image_cache.put(key, photo)
+        return photo
+
+    @staticmethod
+    def country_generator(active: bool, stat_type: StatType, country: Country) -> Callable:
+        import plot_utils  # matplotlib is loaded by the first chart, not at startup
+        if active:
+            return partial(plot_utils.generate_country_active_plot, country, stat_type)
+        return partial(plot_utils.generate_country_total_plot, country, stat_type)
 
     def send_photo_tg_country(self, active: bool, stat_type: StatType, country: Country, chat_id: int,
                               graph_type: GraphType):
-        photo_url = io_utils.get_photo_path_country(graph_type, country_name=country.value)
-        need_data = virus_utils.should_update_data()
+        if self.send_photo_cached(chat_id, graph_type, country):
+            return  # chart of this data version was sent before or exists
 
-        if need_data is False and os.path.exists(photo_url):
-            photo_stream = open(photo_url, 'rb')
-            tg_utils.send_photo_file(self.tgBOT, photo_stream, chat_id)
-        else:
-            if active:
-                plot_tuple = plot_utils.generate_country_active_plot(country, stat_type)
-            else:
-                plot_tuple = plot_utils.generate_country_total_plot(country, stat_type)
+        generate = self.country_generator(active, stat_type, country)
+        self.send_photo_rendered(generate, chat_id, graph_type, country)
 
-            if plot_tuple is not None:
-                fig, ax = plot_tuple
-                tg_utils.send_photo_fig(self.tgBOT, chat_id=chat_id, fig=fig, graph_type=graph_type,
-                                        country=country)
+    def send_photo_tg_country_album(self, country: Country, chat_id: int):
+        """All country charts rendered in parallel and sent as one album"""
+        data = virus_utils.fetch_dataset()  # every chart of the album is rendered from this version
+        if data is None:
+            self.send_message(text=DATA_LOADING, chat_id=chat_id)
+            return
+        version = data.version
+        charts = [(graph_type, self.country_generator(active, stat_type, country))
+                  for _, _, active, stat_type, graph_type in COUNTRY_COMMANDS]
+
+        photos = self.album_photos(charts, country, data, use_file_ids=True)
+        if not photos:
+            print('Album not constructed ' + country.value)
+            return
+        try:
+            tg_utils.send_media_group(self.tgBOT, chat_id, photos, country, version)
+        except BadRequest as e:
+            if all(isinstance(photo, bytes) for _, photo in photos):
+                raise
+            logger.warning('Album with cached file_ids rejected: "%s"', e)
+            for graph_type, photo in photos:
+                if isinstance(photo, str):
+                    file_id_cache.forget_file_id(graph_type, country, version)
+            photos = self.album_photos(charts, country, data, use_file_ids=False)
+            tg_utils.send_media_group(self.tgBOT, chat_id, photos, country, version)
+
+    def album_photos(self, charts: List[Tuple[GraphType, Callable]], country: Country, data: 'dataset.Dataset',
+                     use_file_ids: bool) -> List[Tuple[GraphType, Union[str, bytes]]]:
+        stages = instrumentation.current_stages()  # album tasks add their time to the stages of this update
+        futures = [(graph_type, self.album_executor.submit(instrumentation.call_with_stages, stages, self.album_photo,
+                                                           generate, graph_type, country, data, use_file_ids))
+                   for graph_type, generate in charts]
+        photos = [(graph_type, future.result()) for graph_type, future in futures]
+        return [(graph_type, photo) for graph_type, photo in photos if photo is not None]
+
+    def album_photo(self, generate: Callable, graph_type: GraphType, country: Country, data: 'dataset.Dataset',
+                    use_file_ids: bool) -> Optional[Union[str, bytes]]:
+        """Telegram file_id of the chart if it was sent before, otherwise its cached or newly rendered image"""
+        version = data.version
+        if use_file_ids:
+            file_id = file_id_cache.get_file_id(graph_type, country, version)
+            instrumentation.count_cache('file_id', file_id is not None)
+            if file_id is not None:
+                return file_id
+
+        photo = self.read_photo(graph_type, country, version)
+        if photo is not None:
+            return photo
+
+        key = (graph_type, country, version)
+        try:
+            photo, shared = self.render_flights.do(key, partial(self.render_photo, generate, graph_type, country,
+                                                                data))
+        except Exception as e:
+            logger.error('Render of %s failed: "%s"', graph_type.to_name(), e)
+            return None
+        instrumentation.count_cache('render_flight', shared)
+        if photo is not None and shared is False:
+            self.image_cache.put(key, photo)
+        return photo
 
     def send_photo_tg_country_active(self, stat_type: StatType, country_name: Country, chat_id: int,
                                      graph_type: GraphType):
@@ -265,31 +395,67 @@ class TelegramBot:
         self.send_photo_tg_country(False, stat_type, country_name, chat_id, graph_type)
 
     def send_photo_tg_general(self, stat_type: StatType, chat_id: int, graph_type: GraphType):
-        photo_url = io_utils.get_photo_path_world(graph_type)
-        need_data = virus_utils.should_update_data()
-
-        if need_data is False and os.path.exists(photo_url):  # no data need and photo exists -> return
-            photo_stream = open(photo_url, 'rb')
-            tg_utils.send_photo_file(self.tgBOT, photo_stream, chat_id)
-        else:  # get new data or rewrite existing one
-
-            if graph_type == GraphType.CONFIRMED_1M_PEOPLE:
-                plot_tuple = plot_utils.generate_world_stat_10_per_million(stat_type)
-            elif graph_type == GraphType.DEATHS_RATE:
-                plot_tuple = plot_utils.generate_world_mortality_rate_10()
-            elif graph_type == GraphType.CONFIRMED_BAR or \
-                    graph_type == GraphType.DEATHS_BAR or \
-                    graph_type == GraphType.RECOVERED_BAR:
-                plot_tuple = plot_utils.generate_bar_world_stat_10(stat_type)
-            elif graph_type == GraphType.CONFIRMED_WEEK or \
-                    graph_type == GraphType.DEATHS_WEEK or \
-                    graph_type == GraphType.RECOVERED_WEEK:
-                plot_tuple = plot_utils.generate_toll_plot_avg(stat_type)
-            else:
-                plot_tuple = plot_utils.generate_world_stat_10(stat_type, False)
+        if self.send_photo_cached(chat_id, graph_type):
+            return  # chart of this data version was sent before or exists
+
+        import plot_utils  # matplotlib is loaded by the first chart, not at startup
+        if graph_type == GraphType.CONFIRMED_1M_PEOPLE:
+            generate = partial(plot_utils.generate_world_stat_10_per_million, stat_type)
+        elif graph_type == GraphType.DEATHS_RATE:
+            generate = plot_utils.generate_world_mortality_rate_10
+        elif graph_type == GraphType.CONFIRMED_BAR or \
+                graph_type == GraphType.DEATHS_BAR or \
+                graph_type == GraphType.RECOVERED_BAR:
+            generate = partial(plot_utils.generate_bar_world_stat_10, stat_type)
+        elif graph_type == GraphType.CONFIRMED_WEEK or \
+                graph_type == GraphType.DEATHS_WEEK or \
+                graph_type == GraphType.RECOVERED_WEEK:
+            generate = partial(plot_utils.generate_toll_plot_avg, stat_type)
+        else:
+            generate = partial(plot_utils.generate_world_stat_10, stat_type, False)
+        self.send_photo_rendered(generate, chat_id, graph_type)
+
+    def send_photo_rendered(self, generate: Callable, chat_id: int, graph_type: GraphType, country: Country = None):
+        """Render the chart once for all concurrent requests of the same chart and data version"""
+        data = virus_utils.fetch_dataset()  # the chart is rendered from this version
+        if data is None:
+            self.send_message(text=DATA_LOADING, chat_id=chat_id)
+            return
+        version = data.version
+        key = (graph_type, country, version)
+        try:
+            photo, shared = self.render_flights.do(key, partial(self.render_photo, generate, graph_type, country,
+                                                                data))
+        except single_flight.FlightTimeout:
+            logger.warning('Render of %s timed out, sending the last image', graph_type.to_name())
+            photo_url = io_utils.find_last_photo_path(graph_type, country)  # written only by finished renders
+            if photo_url is not None:
+                with open(photo_url, 'rb') as photo_stream:
+                    tg_utils.send_photo_file(self.tgBOT, photo_stream, chat_id)
+            return
+        except Exception as e:
+            logger.error('Error ocurred: "%s"', e)
+            return
 
-            if plot_tuple is not None:
-                fig, ax = plot_tuple
-                tg_utils.send_photo_fig(self.tgBOT, chat_id=chat_id, fig=fig, graph_type=graph_type)
-            else:
-                print('Plot not constructed ' + graph_type.to_name())
+        instrumentation.count_cache('render_flight', shared)
+        if photo is None:
+            print('Plot not constructed ' + graph_type.to_name())
+            return
+        if shared is False:
+            self.image_cache.put(key, photo)
+        # the renderer may have uploaded it already
+        if shared and tg_utils.send_photo_file_id(self.tgBOT, chat_id, graph_type, country, version):
+            return
+        tg_utils.send_photo_bytes(self.tgBOT, photo, chat_id, graph_type, country, version)
+
+    @staticmethod
+    def render_photo(generate: Callable, graph_type: GraphType, country: Country = None,
+                     data: 'dataset.Dataset' = None) -> Optional[bytes]:
+        import figure_templates
+        with figure_templates.render_session():
+            plot_tuple = generate(data=data)
+            if plot_tuple is None:
+                return None
+            instrumentation.RENDERS.inc(graph_type.to_name())
+            fig, ax = plot_tuple
+            return tg_utils.save_photo_fig(fig, graph_type, country, data.version)
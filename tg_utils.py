@@ -1,41 +1,86 @@
 import io
 import logging
-import matplotlib.pyplot as plt
-import telegram
+from typing import List, Optional, Tuple, TYPE_CHECKING, Union
 
-from matplotlib.figure import Figure
+import telegram
+from telegram.error import BadRequest
 
+import chart_encoder
+import file_id_cache
+import instrumentation
 import io_utils
 from models import GraphType, Country
 
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def send_photo_file(tg_bot: telegram.Bot, photo_stream, chat_id):
-    tg_bot.send_photo(chat_id=chat_id, photo=photo_stream)
+def remember_file_id(message: Optional[telegram.Message], graph_type: GraphType, country: Optional[Country],
+                     version: Optional[str]):
+    # telegram keeps uploaded photos, the largest size id can be sent again without uploading
+    if message is None or not message.photo or version is None:
+        return
+    file_id_cache.put_file_id(graph_type, country, version, message.photo[-1].file_id)
 
 
-def send_photo_fig(tg_bot: telegram.Bot, fig: Figure, chat_id: int, graph_type: GraphType,
-                   country: Country = None):
+def send_photo_file_id(tg_bot: telegram.Bot, chat_id: int, graph_type: GraphType, country: Optional[Country],
+                       version: Optional[str]) -> bool:
+    """Send a previously uploaded chart, returns False if there is no usable file_id"""
+    if version is None:
+        return False
+    file_id = file_id_cache.get_file_id(graph_type, country, version)
+    if file_id is None:
+        return False
     try:
-        logger.info('Sending an image..', extra={'bot': True, 'figure': plt.gcf()})
-        buffer = io.BytesIO()
-        fig.savefig(buffer, format='png')
-        buffer.seek(0)  # have to put the stream pointer back to zero before sending
-        tg_bot.send_photo(chat_id=chat_id, photo=buffer)
-        buffer.close()
-
-        # save photo to disk
-        photo_url = io_utils.get_photo_path_url(graph_type=graph_type, country=country)
-        fig.savefig(photo_url)  # write image to file
-
-        # clear RuntimeWarning: More than 20 figures have been opened. Figures created through the pyplot
-        # interface (`matplotlib.pyplot.figure`) are retained until explicitly closed and may consume too much
-        # memory
-        plt.cla()
-        plt.close(fig)
+        with instrumentation.timer('upload_file_id'):
+            tg_bot.send_photo(chat_id=chat_id, photo=file_id)
+    except BadRequest as e:
+        logger.warning('Cached file_id rejected: "%s"', e)
+        file_id_cache.forget_file_id(graph_type, country, version)
+        return False
+    return True
+
+
+def send_photo_file(tg_bot: telegram.Bot, photo_stream, chat_id, graph_type: GraphType = None,
+                    country: Country = None, version: str = None):
+    with instrumentation.timer('upload'):
+        message = tg_bot.send_photo(chat_id=chat_id, photo=photo_stream)
+    if graph_type is not None:
+        remember_file_id(message, graph_type, country, version)
+
+
+def save_photo_fig(fig: 'Figure', graph_type: GraphType, country: Country = None, version: str = None) -> bytes:
+    """Encode the chart once, the same bytes are sent and saved as the cached image"""
+    with instrumentation.timer('encode'):
+        photo = chart_encoder.encode_figure(fig)
+
+    # save photo to disk, the figure is a reused template and stays open
+    photo_url = io_utils.get_photo_path_url(graph_type=graph_type, country=country, version=version)
+    with instrumentation.timer('save'):
+        io_utils.write_bytes_atomic(photo_url, photo)
+    return photo
+
+
+def send_photo_bytes(tg_bot: telegram.Bot, photo: bytes, chat_id: int, graph_type: GraphType,
+                     country: Country = None, version: str = None):
+    try:
+        logger.info('Sending an image..', extra={'bot': True})
+        send_photo_file(tg_bot, io.BytesIO(photo), chat_id, graph_type, country, version)
     except Exception as e:
         # if things went wrong
         logger.error('Error ocurred: "%s"', e)
+
+
+def send_media_group(tg_bot: telegram.Bot, chat_id: int, photos: List[Tuple[GraphType, Union[str, bytes]]],
+                     country: Country = None, version: str = None):
+    """Send charts as one album, a photo is a telegram file_id or the encoded image to upload"""
+    media = [telegram.InputMediaPhoto(photo if isinstance(photo, str) else io.BytesIO(photo)) for _, photo in photos]
+    with instrumentation.timer('upload_album'):
+        messages = tg_bot.send_media_group(chat_id=chat_id, media=media)
+    for (graph_type, photo), message in zip(photos, messages):
+        if isinstance(photo, bytes):
+            remember_file_id(message, graph_type, country, version)
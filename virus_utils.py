@@ -1,159 +1,347 @@
-import csv
-import datetime
+import hashlib
+import io
 import json
 import os
-import re
+import tempfile
+import threading
 import time
-from collections import defaultdict
-from datetime import datetime
-from io import StringIO
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Tuple, TYPE_CHECKING
 
 import requests
-from dateutil.parser import parse as parsedate
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import instrumentation
 import io_utils
-from models import Country, Countries, TimeSeriesItem
+import prefs_store
+from models import Country, Countries, StatType
+
+if TYPE_CHECKING:
+    import dataset  # numpy is imported on first dataset use, text commands do not need it
 
 timeseries_url = 'https://pomber.github.io/covid19/timeseries.json'
+csse_base_url = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data' \
+                '/csse_covid_19_time_series'
+
+CSSE_GLOBAL_FILES = {
+    StatType.DEATHS: 'time_series_covid19_deaths_global.csv',
+    StatType.RECOVERED: 'time_series_covid19_recovered_global.csv',
+    StatType.CONFIRMED: 'time_series_covid19_confirmed_global.csv'
+}
 
 
 def num(s):
     try:
         return int(s)
-    except ValueError:
+    except (TypeError, ValueError):
         return 0
 
 
 TIMOUT_SEC = 3 * 60 * 60  # 3 hours in seconds
+DOWNLOAD_TIMEOUT_SEC = 60
+CHUNK_SIZE = 64 * 1024
+HTTP_RETRIES = 3
+
+http_session_lock = threading.Lock()
+http_session = None  # keep-alive connections shared by all downloads
+
+download_lock = threading.Lock()
+dataset_lock = threading.Lock()
+snapshot = None  # dataset.Dataset of the latest published version, swapped by a single assignment
+POINTER_CHECK_SEC = 2.0  # a snapshot published by another process is seen after this long at most
+published = (0.0, None, None)  # monotonic time of the last check, pointer file stat, (version, updated)
+
+pref_store_lock = threading.Lock()
+pref_store = None  # opened on first use
 
-pref_country_persist = {}
+
+def get_pref_store() -> prefs_store.PrefStore:
+    global pref_store
+    with pref_store_lock:
+        if pref_store is None:
+            pref_store = prefs_store.PrefStore(io_utils.get_prefs_db_path())
+        return pref_store
 
 
 def read_pref_country(user_id: int) -> Country:
-    country = pref_country_persist.get(user_id)
-    if country is None:
+    country = get_pref_store().get(user_id)
+    if country is None or country not in Countries.__members__:
         return Countries.US  # default value
     return Countries[country]
 
 
 def write_pref_country(user_id: int, country: Countries):
-    pref_country_persist[user_id] = country.displayValue
-
+    get_pref_store().put(user_id, country.displayValue)
 
-def is_remote_file_changed(since_timestamp: int) -> bool:
-    r = requests.head(timeseries_url)
-    if r.status_code == requests.codes.ok:
-        url_time = r.headers['last-modified']
-        url_date = parsedate(url_time)
-        url_date_sec_epoch = int(time.mktime(url_date.timetuple()))
-        return url_date_sec_epoch > since_timestamp
-    return True  # default changed
 
-
-def get_formatted_datetime_change_data() -> str:
-    datetime_stamp = io_utils.read_pref_date()
+def format_datetime_change_data(datetime_stamp: int) -> str:
     return time.strftime('%b %d %Y %H:%M:%S %Z', time.gmtime(datetime_stamp))
 
 
-def should_update_data() -> bool:
-    if os.path.exists(io_utils.get_timeseries_data_path()) is False:  # no source data exists
+def should_update_data(interval_sec: float = TIMOUT_SEC) -> bool:
+    """Time to ask the source for new data, new data gets a new version so cached images never expire by age"""
+    if get_data_version() is None:  # nothing published yet
         return True
-    sec_now = int(time.time())  # current time
-    last_time_modification_sec = int(os.path.getmtime(io_utils.get_timeseries_data_path()))
-    timeout_expire_diff = sec_now - last_time_modification_sec  # need to update date
-    if timeout_expire_diff < TIMOUT_SEC:
-        return False  # file is already up to date
+    return get_data_staleness_sec() >= interval_sec
 
-    datetime_stamp = io_utils.read_pref_date()
-    is_remote_changed = is_remote_file_changed(datetime_stamp)
-    return is_remote_changed
 
+def get_data_staleness_sec() -> float:
+    """Seconds since the source last confirmed the published data, shared by all processes"""
+    # a not modified answer also counts as up to date
+    return time.time() - int(io_utils.read_pref_value('checked', 0))
 
-def fetch_pomper_stat() -> Optional[dict]:
-    should_refresh = should_update_data()
-    if should_refresh is False:
-        # try to return cached data
-        if os.path.exists(io_utils.get_timeseries_data_path()):
-            with open(io_utils.get_timeseries_data_path()) as json_file:
-                data = json.load(json_file)
-                return data
-
-    req = requests.get(timeseries_url)
-    if req.status_code == requests.codes.ok:
-        # save datetime
-        date_timestamp = req.headers['last-modified']
-        url_date = parsedate(date_timestamp)
 
-        ts = time.mktime(url_date.timetuple())
-        io_utils.write_pref_date(int(ts))
+def refresh_data(interval_sec: float = TIMOUT_SEC, force: bool = False) -> Optional[bool]:
+    """
+    Download new data if the check interval passed, concurrent callers wait for one download.
+    Returns True if new data was published, False if there is nothing new, None on failure
+    """
+    if force is False and should_update_data(interval_sec) is False:
+        return False
+    with download_lock:
+        if force is False and should_update_data(interval_sec) is False:
+            return False  # downloaded while waiting for the lock
+        return download_timeseries_data()
 
-        json_data = req.json()
-        # save file
-        io_utils.write_timeseries_data(json_data)
-        return json_data  # the response is a JSON
-    return None
 
+def get_published() -> Optional[Tuple[str, int]]:
+    """
+    Version and update time of the published snapshot, kept in process.
+    The pointer file is checked with a stat at most every POINTER_CHECK_SEC and read only when it changed
+    """
+    global published
+    checked_at, pointer_stat, pointer = published
+    now = time.monotonic()
+    if pointer is not None and now - checked_at < POINTER_CHECK_SEC:
+        return pointer
+    new_stat = io_utils.stat_snapshot_pointer()
+    if new_stat != pointer_stat or pointer is None:
+        pointer = io_utils.read_snapshot_pointer()
+    published = (now, new_stat, pointer)
+    return pointer
 
-def fetch_timeseries_report_deaths() -> Optional[list]:
-    return fetch_timeseries_report('time_series_covid19_deaths_global.csv')
 
+def get_data_version() -> Optional[str]:
+    """Content hash of the published data, None before the first download"""
+    pointer = get_published()
+    return None if pointer is None else pointer[0]
 
-def fetch_timeseries_report_recovered() -> Optional[list]:
-    return fetch_timeseries_report('time_series_covid19_recovered_global.csv')
 
+def make_version(digest) -> str:
+    return digest.hexdigest()[:io_utils.VERSION_LENGTH]
 
-def fetch_timeseries_report_confirmed() -> Optional[list]:
-    return fetch_timeseries_report('time_series_covid19_confirmed_global.csv')
 
+def publish_timeseries(json_file, version: str, updated: int):
+    """
+    Convert a complete pomber json file object into the binary snapshot of its version and point readers to it,
+    updated is when the data changed at the source
+    """
+    global published
+    import dataset
+
+    previous = io_utils.read_snapshot_version()
+    snapshot_path = io_utils.get_snapshot_path(version)
+    if version == previous and os.path.exists(snapshot_path):
+        return  # same content under new headers
+    with instrumentation.timer('parse'):
+        json_data = json.load(json_file)
+    with dataset_lock:
+        data = ingest_dataset(json_data, version, previous)
+        io_utils.write_atomic(snapshot_path, partial(dataset.write_snapshot, data=data), 'wb')
+        io_utils.publish_snapshot(version, updated)
+        published = (time.monotonic(), io_utils.stat_snapshot_pointer(), (version, updated))
+    # readers of the previous version may still be opening it
+    io_utils.remove_stale_files({version, previous})
+
+
+def import_timeseries(json_bytes: bytes, updated: int = None) -> str:
+    """Publish pomber json from another source, returns its version"""
+    version = make_version(hashlib.sha256(json_bytes))
+    publish_timeseries(io.BytesIO(json_bytes), version, int(time.time()) if updated is None else updated)
+    return version
+
+
+def export_timeseries(path: str) -> bool:
+    """Save the published dataset as pomber json"""
+    import dataset
+
+    data = fetch_dataset()
+    if data is None:
+        return False
+    io_utils.write_json_atomic(path, dataset.to_pomber_json(data))
+    return True
+
+
+@instrumentation.timed()
+def fetch_pomper_stat() -> Optional[dict]:
+    """Published data in pomber json format"""
+    import dataset
 
-def fetch_timeseries_report(file_name: str) -> Optional[list]:
-    url = f'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data' \
-          f'/csse_covid_19_time_series/{file_name}'
-    req = requests.get(url)
-    if req.status_code == requests.codes.ok:
+    data = fetch_dataset()
+    return None if data is None else dataset.to_pomber_json(data)
 
-        csv_content = req.text
-
-        data_stats = []
-        csv_file = StringIO(csv_content)
-        csv_reader = csv.DictReader(csv_file)
-        line_count = 0
-        for row in csv_reader:
-            if line_count == 0:
-                line_count += 1
-                print(f'Column names are {", ".join(row)}')
-
-            total = 0
-            dates_stat = defaultdict(int)
-            for key, value in row.items():
-                # print(key)
-                match = re.search(r'\d{1,2}/\d{1,2}/\d{2}', key)
-                if match is not None:
-                    group = match.group().split("/")
-                    year = 2000 + num(group[2])
-                    month = num(group[0])
-                    day = num(group[1])
-                    dt = datetime(year=year, month=month, day=day)
-                    # date = datetime.strptime(match.group(), '%-m/%d/%y').date()
-                    print(dt)
-                    date_str = dt.isoformat()
-                    dates_stat[date_str] = num(value)
-                    total += num(value)
-
-            country = row["Country/Region"]
-            state = row["Province/State"]
-            ts = TimeSeriesItem(state, country, dates_stat, total)
-            data_stats.append(ts)
-            # print(f'\t country: {row["Country/Region"]} {row["Province/State"]} ')
-
-            line_count += 1
-        print(f'Processed {line_count} lines.')
-        return data_stats
+
+@instrumentation.timed('download')
+def download_timeseries_data() -> Optional[bool]:
+    """
+    Conditional GET of the timeseries streamed to a temp file and published as a snapshot named by its content hash.
+    Returns True if a new file was stored, False if remote is not modified, None on failure
+    """
+    headers = {'Accept-Encoding': 'gzip'}
+    if io_utils.read_snapshot_version() is not None:
+        prefs = io_utils.read_prefs()
+        if prefs.get('etag'):
+            headers['If-None-Match'] = prefs['etag']
+        if prefs.get('last_modified'):
+            headers['If-Modified-Since'] = prefs['last_modified']
+
+    try:
+        with requests.get(timeseries_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT_SEC) as req:
+            if req.status_code == requests.codes.not_modified:
+                io_utils.write_pref_values({'checked': int(time.time())})
+                return False
+            if req.status_code != requests.codes.ok:
+                print(f'Cannot download timeseries: {req.status_code}')
+                return None
+
+            updated = get_last_modified(req.headers)
+            with tempfile.TemporaryFile() as json_file:
+                digest = hashlib.sha256()
+                for chunk in req.iter_content(chunk_size=CHUNK_SIZE):  # gzip is decoded on the fly
+                    digest.update(chunk)
+                    json_file.write(chunk)
+                json_file.seek(0)
+                publish_timeseries(json_file, make_version(digest), updated)
+            response_headers = req.headers
+    except requests.RequestException as e:
+        print(f'Cannot download timeseries: {e}')
+        return None
+
+    values = {'checked': int(time.time()),
+              'etag': response_headers.get('etag'),
+              'last_modified': response_headers.get('last-modified'),
+              'datetime': str(updated)}
+    io_utils.write_pref_values(values)
+    return True
+
+
+def get_last_modified(headers) -> int:
+    """Time the source data changed, now if the server does not tell"""
+    if headers.get('last-modified') is None:
+        return int(time.time())
+    from dateutil.parser import parse as parsedate
+    url_date = parsedate(headers['last-modified'])
+    return int(time.mktime(url_date.timetuple()))
+
+
+def ingest_dataset(json_data: dict, version: str, previous_version: Optional[str]) -> 'dataset.Dataset':
+    """Dataset of new pomber json, merged on top of the previous snapshot when only recent days changed"""
+    import dataset
+    import ranking
+    import stats_engine
+
+    previous = None
+    if previous_version is not None and os.path.exists(io_utils.get_snapshot_path(previous_version)):
+        previous = dataset.load_snapshot(io_utils.get_snapshot_path(previous_version), previous_version)
+    merged = None if previous is None else dataset.merge_dataset(previous, json_data, version)
+    if merged is None:
+        data = dataset.build_dataset(json_data, version)
+    else:
+        # only new and revised days are converted and derived again
+        data, first_changed = merged
+        stats_engine.update_metrics(previous, data, first_changed)
+    ranking.get_ranking(data)  # rank countries at ingest, charts only read the index
+    return data
+
+
+def fetch_dataset() -> Optional['dataset.Dataset']:
+    """
+    Published dataset shared by all charts, mapped again only when the data version changes.
+    New data is published by the refresher, a request downloads only if nothing was published yet
+    """
+    global snapshot
+    pointer = get_published()
+    if pointer is None:
+        # nothing stale to serve, e.g. a cold start on an empty /tmp: wait for one download
+        refresh_data()
+        pointer = get_published()
+        if pointer is None:
+            return None
+    version, updated = pointer
+    current = snapshot  # readers take the published snapshot without locking
+    hit = current is not None and current.version == version
+    instrumentation.count_cache('dataset', hit)
+    if hit:
+        return current
+
+    import dataset
+    with dataset_lock:
+        current = snapshot
+        if current is not None and current.version == version:
+            return current  # mapped while waiting for the lock
+        with instrumentation.timer('load'):
+            snapshot = dataset.load_snapshot(io_utils.get_snapshot_path(version), version, updated,
+                                            format_datetime_change_data(updated))
+        return snapshot
+
+
+def get_http_session() -> requests.Session:
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            retry = Retry(total=HTTP_RETRIES, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=len(CSSE_GLOBAL_FILES), max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            http_session = session
+        return http_session
+
+
+def fetch_timeseries_report_deaths() -> Optional['dataset.CsseReport']:
+    return fetch_timeseries_report(CSSE_GLOBAL_FILES[StatType.DEATHS])
+
+
+def fetch_timeseries_report_recovered() -> Optional['dataset.CsseReport']:
+    return fetch_timeseries_report(CSSE_GLOBAL_FILES[StatType.RECOVERED])
+
+
+def fetch_timeseries_report_confirmed() -> Optional['dataset.CsseReport']:
+    return fetch_timeseries_report(CSSE_GLOBAL_FILES[StatType.CONFIRMED])
+
+
+def fetch_timeseries_report(file_name: str) -> Optional['dataset.CsseReport']:
+    url = f'{csse_base_url}/{file_name}'
+    try:
+        req = get_http_session().get(url, timeout=DOWNLOAD_TIMEOUT_SEC)
+    except requests.RequestException as e:
+        print(f'Cannot download {file_name}: {e}')
+        return None
+
+    if req.status_code == requests.codes.ok:
+        import dataset
+        report = dataset.parse_csse_csv(req.text)
+        print(f'Processed {len(report.countries)} lines of {file_name}.')
+        return report
 
     return None
 
 
+def fetch_csse_dataset() -> Optional['dataset.Dataset']:
+    """Download the three CSSE global series at once and merge them into one dataset"""
+    with ThreadPoolExecutor(max_workers=len(CSSE_GLOBAL_FILES)) as executor:
+        futures = {stat_type: executor.submit(fetch_timeseries_report, file_name)
+                   for stat_type, file_name in CSSE_GLOBAL_FILES.items()}
+        reports = {stat_type: future.result() for stat_type, future in futures.items()}
+
+    if any(report is None for report in reports.values()):
+        return None
+    import dataset
+    return dataset.merge_csse_reports(reports)
+
+
 def reformat_large_tick_values(tick_val, pos):
     """
     Turns large tick values (in the billions, millions and thousands) such as 4500 into 4.5K and also appropriately turns 4000 into 4K (no zero after the decimal).